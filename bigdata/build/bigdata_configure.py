@@ -3,15 +3,23 @@ class BigDataEnvVar:
     TEMP_FOLDER = '.temp'
     DOC_TERM_FOLDER = 'doc_term'
     MAT_CAL_FOLDER = 'mat_cal'
-    STANDARD_FORMAT = 'pickle'
+    RUN_FOLDER = 'runs'
+    STANDARD_FORMAT = 'hdf5'
     COMPLEVEL = 5
     COMPLIB = 'blosc'
+    NUM_WORKERS = 1
+    BLOCKS_PER_TASK = 4
+    SIMILARITY_KERNEL = 'sparse'
 
     def __init__(self, kwargs):
         BigDataEnvVar.CHUNKSIZE = int(kwargs.get('chunksize', 5000))
         BigDataEnvVar.TEMP_FOLDER = kwargs.get('temp_folder', '.temp')
         BigDataEnvVar.DOC_TERM_FOLDER = kwargs.get('doc_term_folder', 'doc_term')
         BigDataEnvVar.MAT_CAL_FOLDER = kwargs.get('matrix_cal_folder', 'matrix_cal')
-        BigDataEnvVar.STANDARD_FORMAT = kwargs.get('standard_format', 'pickle')
+        BigDataEnvVar.RUN_FOLDER = kwargs.get('run_folder', 'runs')
+        BigDataEnvVar.STANDARD_FORMAT = kwargs.get('standard_format', 'hdf5')
         BigDataEnvVar.COMPLEVEL = int(kwargs.get('complevel', 5))
         BigDataEnvVar.COMPLIB = kwargs.get('complib', 'blosc')
+        BigDataEnvVar.NUM_WORKERS = int(kwargs.get('num_workers', 1))
+        BigDataEnvVar.BLOCKS_PER_TASK = int(kwargs.get('blocks_per_task', 4))
+        BigDataEnvVar.SIMILARITY_KERNEL = kwargs.get('similarity_kernel', 'sparse')
@@ -1,7 +1,14 @@
+from abc import ABC, abstractmethod
 import tables as tb
 import numpy as np
+from scipy import sparse
 import os
+import shutil
+import json
+import hashlib
 import uuid
+from functools import lru_cache
+from multiprocessing import Pool
 from graph.core.matrix import MatrixCalculation
 from datetime import datetime
 import logging
@@ -10,86 +17,286 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-class BigDataStorageHDF5:
+class BigDataStorage(ABC):
+    """
+    Doc-term store of a big-data run, every chunk is written once as int64 UUIDs and a sparse CSR matrix
+    `write_into_file` returns the paths `read_uuids` and `read_chunk` take back
+    """
+    # Temporary folders of every storage backend, the Doc2Doc storages of BigDataBlockStorage included
     TEMP_STORAGE = os.path.join(os.path.dirname(__file__), conf.BigDataEnvVar.TEMP_FOLDER)
     DOCTERM_STORAGE = os.path.join(TEMP_STORAGE, conf.BigDataEnvVar.DOC_TERM_FOLDER)
     MATRIX_STORAGE = os.path.join(TEMP_STORAGE, conf.BigDataEnvVar.MAT_CAL_FOLDER)
 
-    def __init__(self, temporary=True):
+    @abstractmethod
+    def open(self):
+        pass
+
+    @abstractmethod
+    def init_columns(self):
+        pass
+
+    @abstractmethod
+    def write_into_file(self, chunk_idx, uuids, data):
+        pass
+
+    @abstractmethod
+    def read_chunk(self, chunk_path):
+        pass
+
+    @abstractmethod
+    def read_uuids(self, uuid_path):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @abstractmethod
+    def delete(self):
+        pass
+
+
+class BigDataBlockStorage(ABC):
+    """
+    Doc2Doc store of a big-data run, holding the thresholded similarity block (i, j) of every scheduled pair
+    """
+    @abstractmethod
+    def create_group(self, group_name):
+        pass
+
+    @abstractmethod
+    def write_to_coord_x_y(self, i_group, j_node, data):
+        pass
+
+    def read_block(self, i_group, j_node):
+        """
+        Only blocks with i <= j are stored, (j, i) is served as the transpose of (i, j)
+        :return: Sparse CSR block of the pairs at or above the clustering threshold
+        """
+        if i_group > j_node:
+            return self.__read_stored_block__(j_node, i_group).T.tocsr()
+        return self.__read_stored_block__(i_group, j_node)
+
+    @abstractmethod
+    def __read_stored_block__(self, i_group, j_node):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @abstractmethod
+    def delete(self):
+        pass
+
+
+class BigDataStorageHDF5(BigDataStorage):
+    EXTENSION = '.h5'
+
+    def __init__(self, temporary=True, location=None):
         self.temporary = temporary
         self.uuid = uuid.uuid4()
-        self.location = os.path.join(BigDataStorageHDF5.DOCTERM_STORAGE, str(self.uuid) + '.h5')
+        self.location = os.path.join(BigDataStorage.DOCTERM_STORAGE, str(self.uuid) + '.h5') if location is None \
+            else location
         self.file = None
         self.filters = tb.Filters(complevel=conf.BigDataEnvVar.COMPLEVEL, complib=conf.BigDataEnvVar.COMPLIB)
         self.open()
 
     def open(self):
         logger.info('One-hot matrix is stored at {}'.format(self.location))
-        self.file = tb.open_file(self.location, 'w')
+        os.makedirs(os.path.dirname(self.location), exist_ok=True)
+        # An existing store is reopened in append mode to resume a checkpointed run
+        self.file = tb.open_file(self.location, 'a' if os.path.exists(self.location) else 'w')
 
     def init_columns(self):
-        self.file.create_group(self.file.root, 'uuid')
-        self.file.create_group(self.file.root, 'data')
+        for group_name in ('uuid', 'data'):
+            if '/' + group_name not in self.file:
+                self.file.create_group(self.file.root, group_name)
 
     def write_into_file(self, chunk_idx, uuids, data):
+        """
+        Store a chunk as int64 UUIDs and the CSR triples (indptr, indices, data) of its doc-term matrix
+        :return: Paths of the UUID array and of the chunk group
+        """
         uuid_node = self.file.get_node('/uuid')
         data_node = self.file.get_node('/data')
         chunk_index = 'chunk_' + str(chunk_idx)
+        # Leftovers of a chunk interrupted before it was checkpointed are rewritten
+        for node in (uuid_node, data_node):
+            if chunk_index in node:
+                self.file.remove_node(node, chunk_index, recursive=True)
         uuid_h5 = self.file.create_carray(uuid_node, chunk_index,
-                                          atom=tb.Float32Atom(), shape=(len(uuids),), filters=self.filters)
-        uuid_h5[:] = uuids
-        matrix_h5 = self.file.create_carray(data_node, chunk_index,
-                                            atom=tb.Float32Atom(), shape=data.shape, filters=self.filters)
-        matrix_h5[:] = data
+                                          atom=tb.Int64Atom(), shape=(len(uuids),), filters=self.filters)
+        uuid_h5[:] = np.asarray(uuids, dtype=np.int64)
+        data = sparse.csr_matrix(data, dtype=np.float32)
+        chunk_group = self.file.create_group(data_node, chunk_index)
+        chunk_group._v_attrs.shape = data.shape
+        for name, values, atom in (('indptr', data.indptr, tb.Int64Atom()),
+                                   ('indices', data.indices, tb.Int32Atom()),
+                                   ('data', data.data, tb.Float32Atom())):
+            # Zero-length CArrays are not supported, empty chunks keep a placeholder sliced away on read
+            values_h5 = self.file.create_carray(chunk_group, name, atom=atom, shape=(max(len(values), 1),),
+                                                filters=self.filters)
+            if len(values) > 0:
+                values_h5[:] = values
+        self.file.flush()
         return '/uuid/{}'.format(chunk_index), '/data/{}'.format(chunk_index)
 
+    def read_chunk(self, chunk_path):
+        chunk_group = self.file.get_node(chunk_path)
+        shape = tuple(chunk_group._v_attrs.shape)
+        indptr = chunk_group.indptr[:shape[0] + 1]
+        return sparse.csr_matrix((chunk_group.data[:indptr[-1]], chunk_group.indices[:indptr[-1]], indptr),
+                                 shape=shape)
+
+    def read_uuids(self, uuid_path):
+        return self.file.get_node(uuid_path)[:]
+
     def close(self):
         self.file.close()
         size = os.path.getsize(self.location)
         logger.info('Size of temporary one-hot matrix storage {} bytes ~ {} GB'.format(size, size * (9.31 * 10 ** -10)))
 
     def delete(self):
-        if os.path.exists(BigDataStorageHDF5.TEMP_STORAGE) and os.path.exists(BigDataStorageHDF5.DOCTERM_STORAGE):
-            try:
-                temp_files = os.listdir(BigDataStorageHDF5.DOCTERM_STORAGE)
-                for temp_file in temp_files:
-                    temp_file_path = os.path.join(BigDataStorageHDF5.DOCTERM_STORAGE, temp_file)
-                    try:
-                        os.remove(temp_file_path)
-                    except OSError as e:
-                        logger.error('Failed to delete temporary one-hot matrix storage file {}'.format(temp_file_path))
-                        logger.error(e.args[0])
-            except OSError as e:
-                logger.warning('WARNING - Cleaning temporary one-hot matrix storage process issues. '
-                               'Please contact administrator for technical support')
-                logger.error(e.args[0])
-            finally:
-                logger.info('Cleaned temporary one-hot matrix storage process')
+        # Only the file of this run is removed, checkpoints of other runs stay resumable
+        try:
+            os.remove(self.location)
+        except OSError as e:
+            logger.error('Failed to delete temporary one-hot matrix storage file {}'.format(self.location))
+            logger.error(e.args[0])
+        finally:
+            logger.info('Cleaned temporary one-hot matrix storage process')
+
+
+class BigDataStorageMemmap(BigDataStorage):
+    """
+    Doc-term store of CSR triples kept as .npy files in one folder per run
+    Chunks are opened with np.load(mmap_mode='r'), so worker processes share the pages of the OS cache instead of
+    each holding its own copy
+    """
+    EXTENSION = ''
+
+    def __init__(self, temporary=True, location=None):
+        self.temporary = temporary
+        self.uuid = uuid.uuid4()
+        self.location = os.path.join(BigDataStorage.DOCTERM_STORAGE, str(self.uuid)) if location is None \
+            else location
+        self.open()
+
+    def open(self):
+        logger.info('One-hot matrix is stored at {}'.format(self.location))
+        os.makedirs(self.location, exist_ok=True)
+
+    def init_columns(self):
+        pass
+
+    def write_into_file(self, chunk_idx, uuids, data):
+        chunk_path = os.path.join(self.location, 'chunk_' + str(chunk_idx))
+        data = sparse.csr_matrix(data, dtype=np.float32)
+        np.save(chunk_path + '.uuid.npy', np.asarray(uuids, dtype=np.int64))
+        np.save(chunk_path + '.shape.npy', np.array(data.shape, dtype=np.int64))
+        np.save(chunk_path + '.indptr.npy', data.indptr.astype(np.int64))
+        np.save(chunk_path + '.indices.npy', data.indices.astype(np.int32))
+        np.save(chunk_path + '.data.npy', data.data)
+        return chunk_path + '.uuid.npy', chunk_path
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def read_chunk(chunk_path):
+        shape = tuple(np.load(chunk_path + '.shape.npy').tolist())
+        return sparse.csr_matrix((np.load(chunk_path + '.data.npy', mmap_mode='r'),
+                                  np.load(chunk_path + '.indices.npy', mmap_mode='r'),
+                                  np.load(chunk_path + '.indptr.npy', mmap_mode='r')), shape=shape)
+
+    @staticmethod
+    def read_uuids(uuid_path):
+        return np.load(uuid_path, mmap_mode='r')
+
+    def close(self):
+        BigDataStorageMemmap.read_chunk.cache_clear()
+        size = sum(os.path.getsize(os.path.join(self.location, file)) for file in os.listdir(self.location))
+        logger.info('Size of temporary one-hot matrix storage {} bytes ~ {} GB'.format(size, size * (9.31 * 10 ** -10)))
+
+    def delete(self):
+        BigDataStorageMemmap.read_chunk.cache_clear()
+        try:
+            shutil.rmtree(self.location)
+        except OSError as e:
+            logger.error('Failed to delete temporary one-hot matrix storage folder {}'.format(self.location))
+            logger.error(e.args[0])
+
+
+@lru_cache(maxsize=16)
+def read_packed_chunk(read_chunk, chunk_path):
+    return MatrixCalculation.pack_bits(read_chunk(chunk_path))
+
+
+def compute_similarity_blocks(task):
+    """
+    Worker of the block scheduler: cosine similarity of chunk i against chunks js, read with read_chunk
+    Chunk i is read once for all its blocks, the per-process cache of read_chunk serves repeated chunks
+    Only the pairs at or above the threshold leave the worker, as a sparse block
+    """
+    i, js, chunk_paths, norm_i, norms_j, threshold, kernel, read_chunk = task
+    blocks = []
+    for j, norm_j in zip(js, norms_j):
+        if kernel == 'popcount':
+            # Binary rows bit-packed into uint64 words, intersections counted with popcount
+            dot_sub_mat_ij = MatrixCalculation.popcount_similarity(read_packed_chunk(read_chunk, chunk_paths[i]),
+                                                                   read_packed_chunk(read_chunk, chunk_paths[j]))
         else:
-            os.makedirs(BigDataStorageHDF5.DOCTERM_STORAGE)
-            self.delete()
+            dot_sub_mat_ij = MatrixCalculation.doc_doc_similarity(read_chunk(chunk_paths[i]),
+                                                                  read_chunk(chunk_paths[j]).T,
+                                                                  norm_i, norm_j)
+        rows, cols = np.nonzero(MatrixCalculation.above_threshold(dot_sub_mat_ij, threshold))
+        blocks.append((i, j, sparse.coo_matrix((dot_sub_mat_ij[rows, cols].astype(np.float32), (rows, cols)),
+                                               shape=dot_sub_mat_ij.shape)))
+    return blocks
 
 
-class BigDataMatrixCalculation:
-    def __init__(self, temporary=True):
+class BigDataMatrixCalculation(BigDataBlockStorage):
+    EXTENSION = '.h5'
+
+    def __init__(self, temporary=True, location=None):
         self.temporary = temporary
         self.uuid = uuid.uuid4()
-        self.location = os.path.join(BigDataStorageHDF5.MATRIX_STORAGE, str(self.uuid) + '-matrix-calculation.h5')
+        self.location = os.path.join(BigDataStorage.MATRIX_STORAGE, str(self.uuid) + '-matrix-calculation.h5') \
+            if location is None else location
         self.file = None
         self.filters = tb.Filters(complevel=5, complib='blosc')
         self.open()
 
     def open(self):
-        self.file = tb.open_file(self.location, 'w')
+        os.makedirs(os.path.dirname(self.location), exist_ok=True)
+        self.file = tb.open_file(self.location, 'a' if os.path.exists(self.location) else 'w')
 
     def write_to_coord_x_y(self, i_group, j_node, data):
-        abs_group = '/gmat_{}'.format(str(i_group))
-        matrix_data = self.file.create_carray(abs_group, 'sub_mat_{}'.format(str(j_node)),
-                                              atom=tb.Float32Atom(), shape=data.shape, filters=self.filters)
-        matrix_data[:] = data
+        """
+        Store a thresholded similarity block as its (row, col, score) triples
+        """
+        data = sparse.coo_matrix(data)
+        group_path, block_name = '/gmat_{}'.format(str(i_group)), 'sub_mat_{}'.format(str(j_node))
+        # Leftovers of a block interrupted before it was checkpointed are rewritten
+        if block_name in self.file.get_node(group_path):
+            self.file.remove_node(group_path, block_name, recursive=True)
+        block_group = self.file.create_group(group_path, block_name)
+        block_group._v_attrs.shape = data.shape
+        for name, values, atom in (('row', data.row, tb.Int32Atom()),
+                                   ('col', data.col, tb.Int32Atom()),
+                                   ('score', data.data, tb.Float32Atom())):
+            values_h5 = self.file.create_earray(block_group, name, atom=atom, shape=(0,), filters=self.filters,
+                                                expectedrows=max(len(values), 1))
+            values_h5.append(values)
+        self.file.flush()
+
+    def __read_stored_block__(self, i_group, j_node):
+        block_group = self.file.get_node('/gmat_{}'.format(i_group), 'sub_mat_{}'.format(j_node))
+        return sparse.csr_matrix((block_group.score[:], (block_group.row[:], block_group.col[:])),
+                                 shape=tuple(block_group._v_attrs.shape))
 
     def create_group(self, group_name):
-        self.file.create_group(self.file.root, group_name)
+        if '/' + group_name not in self.file:
+            self.file.create_group(self.file.root, group_name)
 
     def close(self):
         self.file.close()
@@ -97,25 +304,131 @@ class BigDataMatrixCalculation:
         logger.info('Size of temporary Doc2Doc matrix storage {} bytes ~ {} GB'.format(size, size * (9.31 * 10 ** -10)))
 
     def delete(self):
-        if os.path.exists(BigDataStorageHDF5.TEMP_STORAGE) and os.path.exists(BigDataStorageHDF5.MATRIX_STORAGE):
-            try:
-                temp_files = os.listdir(BigDataStorageHDF5.MATRIX_STORAGE)
-                for temp_file in temp_files:
-                    temp_file_path = os.path.join(BigDataStorageHDF5.MATRIX_STORAGE, temp_file)
-                    try:
-                        os.remove(temp_file_path)
-                    except OSError as e:
-                        logger.error('Failed to delete temporary Doc2Doc matrix storage file {}'.format(temp_file_path))
-                        logger.error(e.args[0])
-            except OSError as e:
-                logger.warning('WARNING - Cleaning temporary Doc2Doc matrix storage process issues. '
-                               'Please contact administrator for technical support')
-                logger.error(e.args[0])
-            finally:
-                logger.info('Cleaned temporary Doc2Doc matrix storage process')
-        else:
-            os.makedirs(BigDataStorageHDF5.MATRIX_STORAGE)
-            self.delete()
+        try:
+            os.remove(self.location)
+        except OSError as e:
+            logger.error('Failed to delete temporary Doc2Doc matrix storage file {}'.format(self.location))
+            logger.error(e.args[0])
+        finally:
+            logger.info('Cleaned temporary Doc2Doc matrix storage process')
+
+
+class BigDataMatrixCalculationMemmap(BigDataBlockStorage):
+    """
+    Doc2Doc store of .npy triples in one folder per run, blocks are sliced zero-copy through np.load(mmap_mode='r')
+    """
+    EXTENSION = ''
+
+    def __init__(self, temporary=True, location=None):
+        self.temporary = temporary
+        self.uuid = uuid.uuid4()
+        self.location = os.path.join(BigDataStorage.MATRIX_STORAGE, str(self.uuid) + '-matrix-calculation') \
+            if location is None else location
+        self.open()
+
+    def open(self):
+        os.makedirs(self.location, exist_ok=True)
+
+    def create_group(self, group_name):
+        os.makedirs(os.path.join(self.location, group_name), exist_ok=True)
+
+    def __block_path__(self, i_group, j_node):
+        return os.path.join(self.location, 'gmat_{}'.format(i_group), 'sub_mat_{}'.format(j_node))
+
+    def write_to_coord_x_y(self, i_group, j_node, data):
+        data = sparse.coo_matrix(data)
+        block_path = self.__block_path__(i_group, j_node)
+        np.save(block_path + '.shape.npy', np.array(data.shape, dtype=np.int64))
+        np.save(block_path + '.row.npy', data.row.astype(np.int32))
+        np.save(block_path + '.col.npy', data.col.astype(np.int32))
+        np.save(block_path + '.score.npy', data.data.astype(np.float32))
+
+    def __read_stored_block__(self, i_group, j_node):
+        block_path = self.__block_path__(i_group, j_node)
+        return sparse.csr_matrix((np.load(block_path + '.score.npy', mmap_mode='r'),
+                                  (np.load(block_path + '.row.npy', mmap_mode='r'),
+                                   np.load(block_path + '.col.npy', mmap_mode='r'))),
+                                 shape=tuple(np.load(block_path + '.shape.npy').tolist()))
+
+    def close(self):
+        size = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(self.location)
+                   for file in files)
+        logger.info('Size of temporary Doc2Doc matrix storage {} bytes ~ {} GB'.format(size, size * (9.31 * 10 ** -10)))
+
+    def delete(self):
+        try:
+            shutil.rmtree(self.location)
+        except OSError as e:
+            logger.error('Failed to delete temporary Doc2Doc matrix storage folder {}'.format(self.location))
+            logger.error(e.args[0])
+
+
+# Doc-term and Doc2Doc storage of every BigDataEnvVar.STANDARD_FORMAT
+STORAGE_BACKENDS = {
+    'hdf5': (BigDataStorageHDF5, BigDataMatrixCalculation),
+    'memmap': (BigDataStorageMemmap, BigDataMatrixCalculationMemmap),
+}
+
+
+class BigDataRunManifest:
+    """
+    Checkpoint of a big-data run, kept in the run folder next to its doc-term and Doc2Doc storages
+    manifest.json records the settings, the chunks written and the status; similarity blocks are appended to a
+    journal once written, so checkpointing a block costs one line whatever the number of blocks done
+    """
+    RUN_STORAGE = os.path.join(BigDataStorage.TEMP_STORAGE, conf.BigDataEnvVar.RUN_FOLDER)
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.location = os.path.join(BigDataRunManifest.RUN_STORAGE, run_id)
+        self.path = os.path.join(self.location, 'manifest.json')
+        self.journal_path = os.path.join(self.location, 'blocks.journal')
+        self.settings = {}
+        self.chunks = []
+        self.blocks = set()
+        self.status = 'RUNNING'
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path, 'r') as file:
+            manifest = json.load(file)
+        self.settings, self.chunks, self.status = manifest['settings'], manifest['chunks'], manifest['status']
+        self.blocks = set()
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as file:
+                # A line cut by an interruption has no line break and its block is computed again
+                self.blocks = {tuple(int(k) for k in line.split()) for line in file if line.endswith('\n')}
+        return self
+
+    def save(self):
+        os.makedirs(self.location, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'run_id': self.run_id, 'settings': self.settings, 'chunks': self.chunks,
+                       'status': self.status}, file)
+        # Atomic swap, an interruption leaves the previous manifest intact
+        os.replace(temp_path, self.path)
+
+    def completed_chunks(self):
+        return {chunk[0] for chunk in self.chunks}
+
+    def add_chunk(self, chunk_idx, uuid_path, chunk_path):
+        self.chunks.append([chunk_idx, uuid_path, chunk_path])
+        self.save()
+
+    def add_blocks(self, blocks):
+        with open(self.journal_path, 'a') as file:
+            file.write(''.join('{} {}\n'.format(i, j) for i, j in blocks))
+        self.blocks.update(blocks)
+
+    def delete(self):
+        try:
+            shutil.rmtree(self.location)
+        except OSError as e:
+            logger.error('Failed to delete big data run folder {}'.format(self.location))
+            logger.error(e.args[0])
 
 
 class BigDataReport:
@@ -123,143 +436,239 @@ class BigDataReport:
         self.cluster_docids_map = {}
         self.status = 'ERROR'
         self.chunk_size = 0
+        self.run_id = None
 
 
 class BigDataClusterring:
-    def __init__(self, cluster_threshold, node_ids, storage='hdf5'):
+    """
+    Chunked clustering of data too large for memory, checkpointed in the run folder of `run_id`
+    Constructing it with the run ID of an unfinished run resumes that run: chunks and similarity blocks already
+    recorded in its manifest are skipped. Temporary data is deleted once the run succeeded or when purged
+    """
+    def __init__(self, cluster_threshold, node_ids, storage=None, features=None, run_id=None):
+        storage = conf.BigDataEnvVar.STANDARD_FORMAT if storage is None else storage
+        assert storage in STORAGE_BACKENDS, "Unsupported storage {}".format(storage)
         logger.info('Activate Big Data matrix calculation')
         logger.info('Num_nodes={}, Storage Mode={}, Cluster_threshold={}'.
                     format(len(node_ids), storage, cluster_threshold))
+        self.run_id = uuid.uuid4().hex if run_id is None else run_id
+        self.manifest = BigDataRunManifest(self.run_id)
         self.cluster_similar_threshold = cluster_threshold
         self.node_ids = node_ids
+        self.features = features
+        self.node_columns = MatrixCalculation.column_table(node_ids, max(node_ids, default=-1) + 1)
         self.bigdata_report = BigDataReport()
+        self.bigdata_report.run_id = self.run_id
         self.storage = storage
         self.storage_instance = None
+        self.matrix_calculation = None
         self.table_nodes = []
         self.status = None
         self.init_storage()
 
+    @classmethod
+    def resume(cls, run_id, node_ids, features=None):
+        """
+        Reopen an unfinished run with the threshold and storage it was started with
+        """
+        manifest = BigDataRunManifest(run_id)
+        assert manifest.exists(), "No checkpoint of run {}".format(run_id)
+        settings = manifest.load().settings
+        return cls(settings['cluster_threshold'], node_ids, storage=settings['storage'], features=features,
+                   run_id=run_id)
+
+    @staticmethod
+    def node_fingerprint(node_ids):
+        # Node IDs in column order, another Graph Version with as many nodes maps frames to other columns
+        return hashlib.sha1(np.asarray(node_ids, dtype=np.int64).tobytes()).hexdigest()
+
+    @staticmethod
+    def purge(run_id):
+        BigDataRunManifest(run_id).delete()
+        logger.info('Purged temporary data of run {}'.format(run_id))
+
     def init_storage(self):
-        if self.storage == 'hdf5':
-            self.storage_instance = BigDataStorageHDF5()
-            self.storage_instance.init_columns()
+        settings = {'storage': self.storage, 'cluster_threshold': self.cluster_similar_threshold,
+                    'num_nodes': len(self.node_ids), 'node_fingerprint': self.node_fingerprint(self.node_ids),
+                    'features': None if self.features is None else vars(self.features)}
+        if self.manifest.exists():
+            self.manifest.load()
+            assert self.manifest.settings == settings, "Run {} was started with other settings {}".\
+                format(self.run_id, self.manifest.settings)
+            logger.info('Resume run {} - {} chunks and {} similarity blocks done'.
+                        format(self.run_id, len(self.manifest.chunks), len(self.manifest.blocks)))
+        else:
+            self.manifest.settings = settings
+            self.manifest.save()
+            logger.info('Checkpoint run {} at {}'.format(self.run_id, self.manifest.location))
+        storage_class, matrix_calculation_class = STORAGE_BACKENDS[self.storage]
+        self.storage_instance = storage_class(
+            location=os.path.join(self.manifest.location, 'doc_term' + storage_class.EXTENSION))
+        self.storage_instance.init_columns()
+        self.matrix_calculation = matrix_calculation_class(
+            location=os.path.join(self.manifest.location, 'matrix_calculation' + matrix_calculation_class.EXTENSION))
+        self.table_nodes = [(uuid_path, chunk_path) for _, uuid_path, chunk_path in self.manifest.chunks]
+
+    def has_chunk(self, chunk_idx):
+        return chunk_idx in self.manifest.completed_chunks()
 
     def add(self, chunk_idx, uuids, hashed_stacktraces):
+        if self.has_chunk(chunk_idx):
+            logger.info('--- --- Skipped chunk {} checkpointed already'.format(chunk_idx))
+            return
         assert uuids is not None
         assert hashed_stacktraces is not None
         assert len(uuids) == len(hashed_stacktraces), "Mismatched shape between UUID and Data"
         start = datetime.now()
-        np_matrix = np.array([np.isin(self.node_ids, hash_stacktrace).astype(np.int32)
-                              for hash_stacktrace in hashed_stacktraces])
+        if self.features is not None:
+            # Fixed-width hashed n-gram features instead of one column per node
+            ohv_matrix = self.features.transform_stacktraces(hashed_stacktraces)
+        else:
+            ohv_matrix = self.__lookup_ohv__(hashed_stacktraces)
         logger.info('--- --- Looked up one-hot-matrix within {}'.format(datetime.now() - start))
-        # TODO: Add option to convert crs_matrix format (scipy)
-        # ohv_matrix = csr_matrix(np_matrix)
         start = datetime.now()
-        tb_node = self.storage_instance.write_into_file(chunk_idx, uuids, np_matrix)
+        tb_node = self.storage_instance.write_into_file(chunk_idx, uuids, ohv_matrix)
         logger.info('--- --- Wrote one-hot-matrix into temp storage {}'.format(datetime.now() - start))
         self.table_nodes.append(tb_node)
+        self.manifest.add_chunk(chunk_idx, *tb_node)
+
+    def __lookup_ohv__(self, hashed_stacktraces):
+        lengths = np.array([len(hash_stacktrace) for hash_stacktrace in hashed_stacktraces], dtype=np.int64)
+        frame_ids = np.concatenate(hashed_stacktraces).astype(np.int64) if lengths.sum() > 0 \
+            else np.zeros(0, dtype=np.int64)
+        return MatrixCalculation.one_hot(frame_ids, lengths, self.node_columns, len(self.node_ids), dtype=np.float32)
+
+    def __share_chunks__(self, num_workers):
+        """
+        Chunks of a memmap store are read where they are, an HDF5 store is read in-process by a single worker and
+        exported into a memmap store only when worker processes share it
+        :return: Store the chunks are read from, chunk paths in it and their reader
+        """
+        if isinstance(self.storage_instance, BigDataStorageMemmap):
+            return self.storage_instance, [table_node[1] for table_node in self.table_nodes], \
+                BigDataStorageMemmap.read_chunk
+        if num_workers <= 1:
+            return self.storage_instance, [table_node[1] for table_node in self.table_nodes], \
+                lru_cache(maxsize=16)(self.storage_instance.read_chunk)
+        shared_store = BigDataStorageMemmap(location=os.path.join(self.manifest.location, 'shared'))
+        chunk_paths = [shared_store.write_into_file(i, self.storage_instance.read_uuids(table_node[0]),
+                                                    self.storage_instance.read_chunk(table_node[1]))[1]
+                       for i, table_node in enumerate(self.table_nodes)]
+        return shared_store, chunk_paths, BigDataStorageMemmap.read_chunk
+
+    def __calculate_similarity_blocks__(self, matrix_calculation):
+        """
+        Schedule the upper-triangular blocks (i, j >= i) in tasks of BLOCKS_PER_TASK blocks of one row band over a
+        process pool, the calling process is the single writer of the Doc2Doc storage
+        Blocks checkpointed by an interrupted run of the same run ID are not computed again
+        """
+        start = datetime.now()
+        total_nodes = len(self.table_nodes)
+        task_blocks = []
+        for i in range(total_nodes):
+            matrix_calculation.create_group('gmat_{}'.format(i))
+            js = [j for j in range(i, total_nodes) if (i, j) not in self.manifest.blocks]
+            task_blocks.extend((i, js[start_j:start_j + conf.BigDataEnvVar.BLOCKS_PER_TASK])
+                               for start_j in range(0, len(js), conf.BigDataEnvVar.BLOCKS_PER_TASK))
+        num_blocks = sum(len(js) for _, js in task_blocks)
+        if num_blocks == 0:
+            logger.info('--- All {} group matrices checkpointed already'.format(total_nodes))
+            return
+        num_workers = min(conf.BigDataEnvVar.NUM_WORKERS, len(task_blocks))
+        shared_store, chunk_paths, read_chunk = self.__share_chunks__(num_workers)
+        # Row norms of every chunk are computed once and reused by all the blocks of the chunk
+        chunk_norms = [MatrixCalculation.row_norms(read_chunk(chunk_path)) for chunk_path in chunk_paths]
+        tasks = [(i, js, chunk_paths, chunk_norms[i], [chunk_norms[j] for j in js], self.cluster_similar_threshold,
+                  conf.BigDataEnvVar.SIMILARITY_KERNEL, read_chunk) for i, js in task_blocks]
+        logger.info('--- Scheduled {} of {} blocks in {} tasks over {} workers'.
+                    format(num_blocks, total_nodes * (total_nodes + 1) // 2, len(tasks), max(num_workers, 1)))
+        if num_workers > 1:
+            with Pool(num_workers) as pool:
+                self.__write_blocks__(matrix_calculation, pool.imap_unordered(compute_similarity_blocks, tasks))
+        else:
+            self.__write_blocks__(matrix_calculation, map(compute_similarity_blocks, tasks))
+        read_packed_chunk.cache_clear()
+        if shared_store is not self.storage_instance:
+            shared_store.delete()
+        logger.info('--- Calculated cosine similiarity of {} group matrices - {}'.
+                    format(total_nodes, datetime.now() - start))
+
+    def __cluster_blocks__(self, matrix_calculation):
+        """
+        Greedy leader clustering streamed over the thresholded blocks, one row band at a time
+        The lowest unassigned doc becomes a pivot and claims every unassigned doc similar to it; docs before the
+        pivot are always assigned already, so the upper-triangular blocks (i, j >= i) of its band are sufficient
+        :return: Cluster label of every doc, updated in place band after band
+        """
+        chunk_sizes = [len(self.storage_instance.read_uuids(table_node[0])) for table_node in self.table_nodes]
+        chunk_offsets = np.concatenate(([0], np.cumsum(chunk_sizes))).astype(np.int64)
+        labels = np.full(chunk_offsets[-1], -1, dtype=np.int64)
+        cluster_id = 0
+        for i in range(len(self.table_nodes)):
+            start_band = datetime.now()
+            # Thresholded pairs of the row band with global column indices, never a dense row band
+            rows, cols = [], []
+            for j in range(i, len(self.table_nodes)):
+                block = matrix_calculation.read_block(i, j).tocoo()
+                rows.append(block.row)
+                cols.append(block.col + chunk_offsets[j])
+            band = sparse.csr_matrix((np.ones(sum(len(row) for row in rows), dtype=np.int8),
+                                      (np.concatenate(rows), np.concatenate(cols))),
+                                     shape=(chunk_sizes[i], len(labels)))
+            for rel_pivot in range(chunk_sizes[i]):
+                pivot = chunk_offsets[i] + rel_pivot
+                if labels[pivot] >= 0:
+                    continue
+                neighbors = band.indices[band.indptr[rel_pivot]:band.indptr[rel_pivot + 1]]
+                labels[neighbors[labels[neighbors] < 0]] = cluster_id
+                labels[pivot] = cluster_id
+                cluster_id += 1
+            logger.info('--- --- Clustered chunk {}/{} row band {}'.format(i + 1, len(self.table_nodes),
+                                                                           datetime.now() - start_band))
+        return labels
+
+    def __write_blocks__(self, matrix_calculation, results):
+        for blocks in results:
+            for i, j, dot_sub_mat_ij in blocks:
+                matrix_calculation.write_to_coord_x_y(i, j, dot_sub_mat_ij)
+            # Checkpointed only once written, an interrupted task is computed again on resume
+            self.manifest.add_blocks([(i, j) for i, j, _ in blocks])
 
-    def wipe_out(self):
+    def wipe_out(self, purge=False):
+        """
+        Close the storages of the run, temporary data is deleted only when the run succeeded or when purged,
+        otherwise it is kept so the run can be resumed
+        """
         self.storage_instance.close()
-        self.storage_instance.delete()
-        logger.info('Wiped out temporary data')
+        self.matrix_calculation.close()
+        if self.manifest.status == 'OK' or purge:
+            self.storage_instance.delete()
+            self.matrix_calculation.delete()
+            self.manifest.delete()
+            logger.info('Wiped out temporary data')
+        else:
+            logger.warning('Kept temporary data of unfinished run {} at {}, resume or purge it with its run ID'.
+                           format(self.run_id, self.manifest.location))
 
     def execute(self):
         start = datetime.now()
         # Write Doc-Doc similarity matrix into H5
-        matrix_calculation = BigDataMatrixCalculation()
+        matrix_calculation = self.matrix_calculation
         logger.info('Saving temporary Doc2Doc similarity matrix storage at {}'.format(matrix_calculation.location))
         logger.info('STEP 2/3: CALCULATE COSINE SIMILARITY')
-        total_nodes = len(self.table_nodes)
-        for i in range(len(self.table_nodes)):
-            start_loop = datetime.now()
-            matrix_calculation.create_group('gmat_{}'.format(i))
-            doc_term_f = self.storage_instance.file
-            tb_node_i = doc_term_f.get_node(self.table_nodes[i][1], classname='Array')
-            matrix_chunk_1 = np.array(tb_node_i)
-            for j in range(len(self.table_nodes)):
-                tb_node_j = doc_term_f.get_node(self.table_nodes[j][1], classname='Array')
-                matrix_chunk_2 = np.array(tb_node_j)
-                dot_sub_mat_ij = MatrixCalculation.doc_doc_similarity(matrix_chunk_1, matrix_chunk_2.T)
-                matrix_calculation.write_to_coord_x_y(i, j, dot_sub_mat_ij)
-            logger.info('--- Calculated cosine similiarity of group matrix gmat_{}/{} - {}'.
-                        format(i, total_nodes - 1, datetime.now() - start_loop))
+        self.__calculate_similarity_blocks__(matrix_calculation)
         logger.info('Saved temporary Doc2Doc similarity matrix storage within {}'.format(datetime.now() - start))
 
         start1 = datetime.now()
         logger.info('Clustering big data Doc2Doc similarity matrix')
         logger.info('STEP 3/3: CLUSTER MATRIX')
-        # Cluster matrix similarity - join row by row by iterating on y-coordinate
-        clusterid_docids_map = {}
-        cluster_id = 0
-        grouped_indices = []
-        inc_index_i = 0
-        for i in range(len(self.table_nodes)):
-            logger.info('--- Iterating chunk {}/{} row matrix'.format(i + 1, total_nodes))
-            # Hstack on chunk matrix
-            start_stack = datetime.now()
-            pivot_i_submat = np.array(matrix_calculation.file.get_node('/gmat_{}'.format(i),
-                                                                       'sub_mat_0',
-                                                                       classname='Array'))
-            abs_docid_i = set(list(range(inc_index_i, pivot_i_submat.shape[0] + inc_index_i)))
-            leftover_abs_i_indices = list(set(abs_docid_i) - (set(abs_docid_i) & set(grouped_indices)))
-            leftover_rel_i_indices = list(np.array(leftover_abs_i_indices) - inc_index_i)
-            row_matrix = np.array([])
-            for j in range(len(self.table_nodes)):
-                sub_mat_j = np.array(matrix_calculation.file.get_node('/gmat_{}'.format(i),
-                                                                      'sub_mat_{}'.format(j),
-                                                                      classname='Array'))
-                row_matrix = np.hstack((row_matrix, sub_mat_j[leftover_rel_i_indices])) if row_matrix.size \
-                    else sub_mat_j[leftover_rel_i_indices]
-            logger.info('--- --- Stacked horizontal row matrix {} '.format(datetime.now() - start_stack))
-
-            # Cluster on hstack matrix
-            start_cluster = datetime.now()
-            leftover_abs_j_indices = list(set(list(range(row_matrix.shape[1]))) - set(grouped_indices))
-            rel_docids = list(range(row_matrix.shape[0]))
-            abs_docids = np.array(rel_docids) + inc_index_i
-            abs_intersection = list(set(abs_docids) & set(leftover_abs_j_indices))
-            rel_itersection = (np.array(abs_intersection) - inc_index_i).tolist()
-            while len(rel_itersection) > 0:
-                rel_pivot = rel_itersection[0]
-                abs_pivot = rel_pivot + inc_index_i
-                if abs_pivot + 1 == row_matrix.shape[1]:
-                    break
-                abs_sim_indicies = np.where(row_matrix[rel_pivot][abs_pivot + 1:] >= self.cluster_similar_threshold)[0]
-                abs_sim_indicies = list(set(abs_sim_indicies) & set(leftover_abs_j_indices))
-                abs_sim_indicies.append(abs_pivot)
-                grouped_indices.extend(abs_sim_indicies)
-
-                clusterid_docids_map[cluster_id] = clusterid_docids_map.get(cluster_id, []) + abs_sim_indicies
-                cluster_id += 1
-
-                leftover_abs_j_indices = list(set(list(range(row_matrix.shape[1]))) - set(grouped_indices))
-                rel_docids = list(range(row_matrix.shape[0]))
-                abs_docids = np.array(rel_docids) + inc_index_i
-                abs_intersection = list(set(abs_docids) & set(leftover_abs_j_indices))
-                rel_itersection = (np.array(abs_intersection) - inc_index_i).tolist()
-
-                total_est_clusterd_id = sum([len(_) for _ in clusterid_docids_map.values()])
-                total_real_clustered_id = len(grouped_indices)
-                total_leftover_id = len(leftover_abs_j_indices)
-                total_doc = row_matrix.shape[1]
-                assert total_est_clusterd_id == total_real_clustered_id, \
-                    'Estimate {} - Real {} - Leftover {} - Total {}'. \
-                        format(total_est_clusterd_id, total_real_clustered_id, total_leftover_id, total_doc)
-                # FIXME: check total
-                # assert total_leftover_id + total_real_clustered_id == total_doc, \
-                #     'Estimate {} - Real {} - Leftover {} - Total {}'.\
-                #     format(total_est_clusterd_id, total_real_clustered_id, total_leftover_id, total_doc)
-            logger.info('--- --- Clustered chunk {} row matrix {} '.format(i + 1, datetime.now() - start_cluster))
-            inc_index_i += pivot_i_submat.shape[0]
-
+        labels = self.__cluster_blocks__(matrix_calculation)
         start_reindex = datetime.now()
-        for k, v in clusterid_docids_map.items():
-            clusterid_docids_map[k] = sorted(v)
+        clusterid_docids_map = MatrixCalculation.group_labels(labels)
         logger.info('Reindexed clustering docids {}'.format(datetime.now() - start_reindex))
         # Prepare report
         self.bigdata_report.cluster_docids_map = clusterid_docids_map
         self.bigdata_report.status = 'OK'
+        self.manifest.status = 'OK'
+        self.manifest.save()
         logger.info('Finished clustering big data Doc2Doc similarity matrix within {}'.format(datetime.now() - start1))
-        matrix_calculation.close()
-        matrix_calculation.delete()
@@ -1,9 +1,11 @@
 from datetime import datetime
+from multiprocessing import Pool
 from graph.core.graph_manager import GraphManager
 from database.data_retriever import DataRetriever
 from ki_django import global_config
 from database import database_exception, data_inserter
 from graph.build import graph_distributor as g_dis
+from graph.build import graph_configure as g_conf
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,12 +17,14 @@ class GraphBuilder:
                  graph_manager=None,
                  load_graph=False,
                  save_graph=False,
-                 data_executor=None):
+                 data_executor=None,
+                 num_workers=None):
         self.graph_parser = graph_parser
         self.load_graph = load_graph
         self.save_graph = save_graph
         self.graph_manager = graph_manager
         self.data_executor = data_executor
+        self.num_workers = g_conf.GraphEnvVar.NUM_WORKERS if num_workers is None else num_workers
 
     def load(self):
         if self.load_graph is True:
@@ -44,6 +48,8 @@ class GraphBuilder:
             raise database_exception.DataRetrieverReturnEmptyData()
 
     def __fit_generator__(self, generator):
+        if self.num_workers > 1:
+            return self.__fit_generator_parallel__(generator)
         logger.info('Initializing Graph Version')
         start = datetime.now()
         acc_offset = 0
@@ -56,6 +62,32 @@ class GraphBuilder:
         logger.info("Read {} records within {}".format(acc_offset, datetime.now() - start))
         self.graph_manager.save()
 
+    def __fit_generator_parallel__(self, generator):
+        logger.info('Initializing Graph Version with {} worker processes'.format(self.num_workers))
+        start = datetime.now()
+        acc_offset = 0
+        chunk_size = g_conf.GraphEnvVar.CHUNK_SIZE
+        with Pool(processes=self.num_workers) as pool:
+            for data in generator:
+                logger.info("--- Reading record {} to record {}".format(acc_offset, acc_offset + len(data)))
+                uuid, error_logs, static_attributes = DataRetriever.get_only_necessary_data(data)
+                assert len(uuid) == len(error_logs), "UUID and Error Logs must be the same length"
+                # UUIDs tracked by the Graph already are dropped as in the serial path, so re-ingested records are
+                # not counted twice
+                uuid_index = self.graph_manager.stacktrace_manager.uuid
+                keep = [i for i, _id in enumerate(uuid) if _id not in uuid_index]
+                new_uuid, new_error_logs = [uuid[i] for i in keep], [error_logs[i] for i in keep]
+                new_static_attributes = None if static_attributes is None else [static_attributes[i] for i in keep]
+                # Workers parse and build partial graphs of each chunk, the master merges them in chunk order
+                chunks = [(self.graph_parser, new_uuid[i:i + chunk_size], new_error_logs[i:i + chunk_size],
+                           None if new_static_attributes is None else new_static_attributes[i:i + chunk_size])
+                          for i in range(0, len(new_uuid), chunk_size)]
+                self.graph_manager.add_partials(pool.map(build_partial_graph, chunks), offset=acc_offset)
+                self.__record_process__(uuid)
+                acc_offset += len(error_logs)
+        logger.info("Read {} records within {}".format(acc_offset, datetime.now() - start))
+        self.graph_manager.save()
+
     def fit(self, data_bundles):
         assert isinstance(data_bundles, tuple)
         uuid, error_logs = data_bundles
@@ -76,3 +108,8 @@ class GraphBuilder:
     def __record_process__(self, uuids):
         d_insert = data_inserter.DataInserter(authentication=self.data_executor.get_authentication())
         return d_insert.__insert_analyzed_graph_uuid__(g_dis.g_distributor.master.hashcode, uuids)
+
+
+def build_partial_graph(chunk):
+    graph_parser, uuid, error_logs, static_attributes = chunk
+    return GraphManager.build_partial(list(uuid), graph_parser.parse(error_logs), static_attributes)
@@ -1,5 +1,7 @@
 import os
 from graph.core import graph_manager
+from graph.core import cluster_model
+from graph.core import features
 from graph.build import graph_loader, graph_saver, graph_version_history
 from graph.build import graph_distributor as g_dis
 
@@ -7,6 +9,7 @@ from graph.build import graph_distributor as g_dis
 class GraphEnvVar:
     STORAGE_LOCATION = 'default'
     FOLDER_STORAGE = 'graph_storage'
+    FOLDER_CLUSTER_MODEL = 'cluster_model_storage'
     LOAD_GRAPH = True
     SAVE_GRAPH = False
     ALGORITHMS = 'default'
@@ -16,10 +19,30 @@ class GraphEnvVar:
     FORCE_SPEEDUP = False
     GRAPH_DISTRIBUTED = True
     DISTRIBUTED_LOCATION = 'distributed'
+    EDGE_DELTA_SIZE = 100000
+    NUM_WORKERS = 1
+    INGEST_MEMORY_BUDGET = 256 * 1024 * 1024
+    TOP_K_CAPACITY = 100
+    LSH_CANDIDATES = False
+    LSH_NUM_PERM = 128
+    LSH_NUM_BANDS = 32
+    LSH_MAX_BUCKET_SIZE = 64
+    CLUSTER_SIM_THRESHOLD = 0.8
+    MERGE_TREE_MIN_THRESHOLD = 0.5
+    KMEANS_N_CLUSTERS = 3
+    KMEANS_BATCH_SIZE = 1024
+    DBSCAN_EPS = 2.0
+    DBSCAN_MIN_SAMPLES = 3
+    PROFILE_MEMORY = False
+    BALANCE_WEIGHTS = False
+    FEATURES = 'one-hot'
+    HASHING_N_FEATURES = 2 ** 14
+    NGRAM_MAX_N = 2
 
     def __init__(self, kwargs):
         GraphEnvVar.STORAGE_LOCATION = kwargs.get('storage_location', 'default')
         GraphEnvVar.FOLDER_STORAGE = kwargs.get('folder_storage', 'graph_storage')
+        GraphEnvVar.FOLDER_CLUSTER_MODEL = kwargs.get('folder_cluster_model', 'cluster_model_storage')
         GraphEnvVar.LOAD_GRAPH = bool(kwargs.get('load_graph', True))
         GraphEnvVar.SAVE_GRAPH = bool(kwargs.get('save_graph', False))
         GraphEnvVar.ALGORITHMS = kwargs.get('algorithms', 'default')
@@ -29,8 +52,34 @@ class GraphEnvVar:
         GraphEnvVar.FORCE_SPEEDUP = bool(kwargs.get('force_speedup', False))
         GraphEnvVar.GRAPH_DISTRIBUTED = bool(kwargs.get('graph_distributed', True))
         GraphEnvVar.DISTRIBUTED_LOCATION = kwargs.get('distributed_location', 'distributed')
+        GraphEnvVar.EDGE_DELTA_SIZE = int(kwargs.get('edge_delta_size', 100000))
+        GraphEnvVar.NUM_WORKERS = int(kwargs.get('num_workers', 1))
+        GraphEnvVar.INGEST_MEMORY_BUDGET = int(kwargs.get('ingest_memory_budget', 256 * 1024 * 1024))
+        GraphEnvVar.TOP_K_CAPACITY = int(kwargs.get('top_k_capacity', 100))
+        GraphEnvVar.LSH_CANDIDATES = bool(kwargs.get('lsh_candidates', False))
+        GraphEnvVar.LSH_NUM_PERM = int(kwargs.get('lsh_num_perm', 128))
+        GraphEnvVar.LSH_NUM_BANDS = int(kwargs.get('lsh_num_bands', 32))
+        GraphEnvVar.LSH_MAX_BUCKET_SIZE = int(kwargs.get('lsh_max_bucket_size', 64))
+        GraphEnvVar.CLUSTER_SIM_THRESHOLD = float(kwargs.get('cluster_sim_threshold', 0.8))
+        GraphEnvVar.MERGE_TREE_MIN_THRESHOLD = float(kwargs.get('merge_tree_min_threshold', 0.5))
+        GraphEnvVar.KMEANS_N_CLUSTERS = int(kwargs.get('kmeans_n_clusters', 3))
+        GraphEnvVar.KMEANS_BATCH_SIZE = int(kwargs.get('kmeans_batch_size', 1024))
+        GraphEnvVar.DBSCAN_EPS = float(kwargs.get('dbscan_eps', 2.0))
+        GraphEnvVar.DBSCAN_MIN_SAMPLES = int(kwargs.get('dbscan_min_samples', 3))
+        GraphEnvVar.PROFILE_MEMORY = bool(kwargs.get('profile_memory', False))
+        GraphEnvVar.BALANCE_WEIGHTS = bool(kwargs.get('balance_weights', False))
+        GraphEnvVar.FEATURES = kwargs.get('features', 'one-hot')
+        GraphEnvVar.HASHING_N_FEATURES = int(kwargs.get('hashing_n_features', 2 ** 14))
+        GraphEnvVar.NGRAM_MAX_N = int(kwargs.get('ngram_max_n', 2))
         GraphEnvVar.init_services()
 
+    @staticmethod
+    def init_features():
+        # Hashed n-gram features shared by the one-shot and big-data analyzers, None keeps the one-hot matrix
+        if GraphEnvVar.FEATURES == 'ngram':
+            return features.HashedNgramFeatures(GraphEnvVar.HASHING_N_FEATURES, GraphEnvVar.NGRAM_MAX_N)
+        return None
+
     @staticmethod
     def init_services():
         if GraphEnvVar.GRAPH_DISTRIBUTED is True:
@@ -59,6 +108,8 @@ class GraphConfigMechanism:
         self.graph_loader = None
         self.graph_saver = None
         self.graph_version_history = None
+        self.graph_version = None
+        self.cluster_model_location = None
         self.__init_configure__()
 
     def __init_configure__(self):
@@ -68,10 +119,10 @@ class GraphConfigMechanism:
 
     def __check_location__(self):
         if self.storage_location == 'default':
-            self.storage_location = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                                 GraphEnvVar.FOLDER_STORAGE)
-        else:
-            self.storage_location = os.path.join(self.storage_location, GraphEnvVar.FOLDER_STORAGE)
+            self.storage_location = os.path.dirname(os.path.abspath(__file__))
+        # Cluster models are kept beside, not inside, the Graph Version folder whose files count as versions
+        self.cluster_model_location = os.path.join(self.storage_location, GraphEnvVar.FOLDER_CLUSTER_MODEL)
+        self.storage_location = os.path.join(self.storage_location, GraphEnvVar.FOLDER_STORAGE)
 
     def __init_graph_version_history__(self):
         self.graph_version_history = graph_version_history.GraphVersionHistory(self.storage_location)
@@ -80,13 +131,30 @@ class GraphConfigMechanism:
         self.graph_loader = graph_loader.GraphLoader(self.storage_location)
         self.graph_loader.node_manager = graph_manager.NodeManager()
         self.graph_loader.stacktrace_manager = graph_manager.StacktraceManager()
+        self.graph_loader.cluster_model = cluster_model.ClusterModel()
         if self.load_graph is True:
-            current_graph_version = self.graph_version_history.active_latest_version()
-            if current_graph_version is not None:
-                self.graph_loader.load(current_graph_version.uuid)
+            self.graph_version = self.graph_version_history.active_latest_version()
+            if self.graph_version is not None:
+                self.graph_loader.load(self.graph_version.uuid)
+                # A cluster model saved after the Graph Version supersedes the one pickled with it
+                cluster_model_path = os.path.join(self.cluster_model_location, self.graph_version.uuid)
+                if os.path.exists(cluster_model_path):
+                    self.graph_loader.cluster_model = cluster_model.ClusterModel.load(cluster_model_path)
 
     def __post_action__(self, _graph_manager):
         if self.save_graph is True:
-            graph_version = self.graph_version_history.register(_graph_manager)
+            self.graph_version = self.graph_version_history.register(_graph_manager)
             self.graph_saver = graph_saver.GraphSaver(self.storage_location)
-            self.graph_saver.save(graph_version.path, _graph_manager)
+            self.graph_saver.save(self.graph_version.path, _graph_manager)
+
+    def save_cluster_model(self, _cluster_model):
+        """
+        Persist the cluster model of the current Graph Version without saving a new Graph Version
+        :return: Path of the saved cluster model, None when the graph is not saved or has no Graph Version yet
+        """
+        if self.save_graph is not True or self.graph_version is None:
+            return None
+        os.makedirs(self.cluster_model_location, exist_ok=True)
+        cluster_model_path = os.path.join(self.cluster_model_location, self.graph_version.uuid)
+        _cluster_model.save(cluster_model_path)
+        return cluster_model_path
@@ -8,43 +8,97 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+class LegacyGraphObject:
+    """
+    Plain attribute holder standing in for the graph classes of Graph Versions pickled before frame interning
+    """
+    pass
+
+
+class LegacyGraphUnpickler(pickle.Unpickler):
+    """
+    Unpickler of Graph Versions pickled before frame interning, whose MD5-keyed managers and Nodes with edge dicts
+    no longer match the current classes
+    """
+    LEGACY_CLASSES = ('GraphManager', 'NodeManager', 'StacktraceManager', 'Node')
+
+    def find_class(self, module, name):
+        if module == graph_manager.__name__ and name in LegacyGraphUnpickler.LEGACY_CLASSES:
+            return LegacyGraphObject
+        return super().find_class(module, name)
+
+
 class GraphLoader:
     def __init__(self, storage_location, format_type='pickle'):
         self.storage_location = storage_location
         self.file_format = format_type
         self.node_manager = None
         self.stacktrace_manager = None
+        self.cluster_model = None
 
     @staticmethod
     def __json2graph__(json_obj):
-        def dict2node(dictionary):
-            node = graph_manager.Node(dictionary['name'], dictionary['weight'])
-            node.out_edge = dictionary['out_edge']
-            node.in_edge = dictionary['in_edge']
-            node.fre_id_stacktrace = dictionary['fre_id_stacktrace']
-            # node.static_attribute = dictionary['static_attribute']
-            return node
-
         try:
-            # Read Node Manager from json oject
+            # Read Node Manager from json oject, re-interning MD5 hash IDs into frame IDs
             node_manager = graph_manager.NodeManager()
-            node_manager.pool = {dictionary['hash_id']: dict2node(dictionary) for dictionary in
-                                 json_obj['node_pool']}
+            frame_dictionary = node_manager.frame_dictionary
+            hash_frame_map = {dictionary['hash_id']: frame_dictionary.intern(dictionary['name'])
+                              for dictionary in json_obj['node_pool']}
 
             # Read Stacktrace Manager from json object
             stacktrace_manager = graph_manager.StacktraceManager()
-            stacktrace_manager.uuid = json_obj['stacktrace_manager']['uuid']
-            stacktrace_manager.stacktrace = json_obj['stacktrace_manager']['stacktrace']
-            stacktrace_manager.node_stacktrace = {k: [node_manager.pool[_] for _ in v] for k, v in
-                                                  json_obj['stacktrace_manager']['node_stacktrace'].items()}
-            stacktrace_manager.freq_stacktrace = json_obj['stacktrace_manager']['freq_stacktrace']
-            stacktrace_manager.uuid_nodes_map = {k: [node_manager.pool[_] for _ in v] for k, v in
-                                                 json_obj['stacktrace_manager']['uuid_nodes_map'].items()}
+            json_stacktrace_manager = json_obj['stacktrace_manager']
+            hash_stacktrace_map = {}
+            for hash_id, stacktrace in json_stacktrace_manager['stacktrace'].items():
+                frame_ids = frame_dictionary.intern_stacktrace(stacktrace)
+                id_stacktrace = stacktrace_manager.get_id_stacktrace(frame_ids)
+                hash_stacktrace_map[hash_id] = id_stacktrace
+            stacktrace_manager.uuid = graph_manager.UUIDIndex(json_stacktrace_manager['uuid'])
+            hash_freqs = json_stacktrace_manager['freq_stacktrace']
+            stacktrace_manager.add_freqs([hash_stacktrace_map[k] for k in hash_freqs.keys()], list(hash_freqs.values()))
+            for k, v in json_stacktrace_manager['uuid_nodes_map'].items():
+                stacktrace_manager.uuids.append(int(k))
+                stacktrace_manager.uuid_stacktrace.append(
+                    stacktrace_manager.get_id_stacktrace([hash_frame_map[_] for _ in v]))
+
+            def dict2node(dictionary):
+                node = graph_manager.Node(dictionary['name'], dictionary['weight'])
+                # node.static_attribute = dictionary['static_attribute']
+                return node
+
+            node_manager.pool = {hash_frame_map[dictionary['hash_id']]: dict2node(dictionary) for dictionary in
+                                 json_obj['node_pool']}
+            node_manager.add_weights(list(node_manager.pool.keys()),
+                                     [node.weight for node in node_manager.pool.values()])
+            # Incoming edges are the transpose of outgoing edges, only the latter are read back
+            edges, freqs = [], []
+            for dictionary in json_obj['node_pool']:
+                frame_id = hash_frame_map[dictionary['hash_id']]
+                edges.extend((frame_id, hash_frame_map[k], v) for k, v in dictionary['out_edge'].items())
+                freqs.extend((frame_id, hash_stacktrace_map[k], v) for k, v in dictionary['fre_id_stacktrace'].items())
+            for store, triples in ((node_manager.out_edges, edges), (node_manager.stacktrace_freq, freqs)):
+                if len(triples) > 0:
+                    store.add_batch(*zip(*triples))
             return node_manager, stacktrace_manager
         except KeyError as error:
             logger.error('Failed to convert JSON to Graph Manager - No Key {}'.format(error.args[0]))
             return None
 
+    @staticmethod
+    def __legacy2json__(legacy_graph_manager):
+        # Same JSON object the MD5-keyed managers were saved as, so __json2graph__ migrates them
+        node_manager, stacktrace_manager = legacy_graph_manager.node_manager, legacy_graph_manager.stacktrace_manager
+        node_pool = [{'hash_id': hash_id, 'name': node.name, 'weight': node.weight, 'out_edge': node.out_edge,
+                      'in_edge': node.in_edge, 'fre_id_stacktrace': node.fre_id_stacktrace}
+                     for hash_id, node in node_manager.pool.items()]
+        uuid_nodes_map = {k: [graph_manager.GraphUtil.__hash_md5__(node.name) for node in v]
+                          for k, v in stacktrace_manager.uuid_nodes_map.items()}
+        return {'node_pool': node_pool,
+                'stacktrace_manager': {'uuid': stacktrace_manager.uuid,
+                                       'stacktrace': stacktrace_manager.stacktrace,
+                                       'freq_stacktrace': stacktrace_manager.freq_stacktrace,
+                                       'uuid_nodes_map': uuid_nodes_map}}
+
     def load(self, path):
         start = datetime.now()
         if os.path.exists(self.storage_location):
@@ -74,13 +128,23 @@ class GraphLoader:
     def __load_from_pickle__(self, path):
         try:
             file_path = os.path.join(self.storage_location, path)
-            file = open(file_path, 'rb')
-            _graph_manager = pickle.load(file)
-            file.close()
-            self.node_manager, self.stacktrace_manager = _graph_manager.node_manager, _graph_manager.stacktrace_manager
-            logger.info('Loaded pretrained Graph from "{}" location'.format(self.storage_location))
+            with open(file_path, 'rb') as file:
+                try:
+                    _graph_manager = pickle.load(file)
+                except Exception as error:
+                    # Graph Versions pickled before frame interning are migrated through their JSON form
+                    logger.warning('Failed to load Graph as current format due to "{}" - '
+                                   'migrating legacy Graph Version'.format(error))
+                    file.seek(0)
+                    _graph_manager = LegacyGraphUnpickler(file).load()
+                    _graph_manager.node_manager, _graph_manager.stacktrace_manager = \
+                        GraphLoader.__json2graph__(GraphLoader.__legacy2json__(_graph_manager))
         except Exception as error:
-            logger.error('Failed to load Graph from file due to "{}"'.format(error.args[0]))
+            logger.error('Failed to load Graph from file due to "{}"'.format(error))
+            raise
+        self.node_manager, self.stacktrace_manager = _graph_manager.node_manager, _graph_manager.stacktrace_manager
+        self.cluster_model = getattr(_graph_manager, 'cluster_model', self.cluster_model)
+        logger.info('Loaded pretrained Graph from "{}" location'.format(self.storage_location))
 
     def __load_from_hdf5__(self, path):
         # TODO load from HDF5
@@ -2,7 +2,7 @@ import json
 import os
 import pickle
 from datetime import datetime
-from graph.core import graph_manager as gm
+from graph.build import graph_configure as g_conf
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,27 +15,42 @@ class GraphSaver:
 
     @staticmethod
     def __graph2json__(node_manager, stacktrace_manager):
-        def node2dict(hash_id, node):
-            return {'hash_id': hash_id,
+        # Frame and stacktrace IDs are process-local, persist them by their MD5 form
+        frame_hash_ids = [node_manager.frame_dictionary.hash_id(frame_id)
+                          for frame_id in range(len(node_manager.frame_dictionary))]
+        stacktrace_hash_ids = [stacktrace_manager.hash_id(id_stacktrace, node_manager.frame_dictionary)
+                               for id_stacktrace in range(len(stacktrace_manager))]
+        node_manager.compact()
+        in_edges = node_manager.in_edges()
+
+        def node2dict(frame_id, node):
+            return {'hash_id': frame_hash_ids[frame_id],
                     'name': node.name,
                     'weight': node.weight,
-                    'out_edge': node.out_edge,
-                    'in_edge': node.in_edge,
-                    'fre_id_stacktrace': node.fre_id_stacktrace}
+                    'out_edge': {frame_hash_ids[k]: v for k, v in node_manager.out_edges.row_dict(frame_id).items()},
+                    'in_edge': {frame_hash_ids[k]: v for k, v in in_edges.row_dict(frame_id).items()},
+                    'fre_id_stacktrace': {stacktrace_hash_ids[k]: v for k, v in
+                                          node_manager.stacktrace_freq.row_dict(frame_id).items()}}
 
         parent_json_object = dict()
         # Convert Node Manager to json object
-        json_obj_nodes = [node2dict(hash_id, node) for hash_id, node in
+        json_obj_nodes = [node2dict(frame_id, node) for frame_id, node in
                           node_manager.pool.items()]
         # Convert Stacktrace Manager to json object
         json_stacktrace_manager = dict()
-        json_stacktrace_manager['uuid'] = stacktrace_manager.uuid
-        json_stacktrace_manager['stacktrace'] = stacktrace_manager.stacktrace
-        json_stacktrace_manager['node_stacktrace'] = {k: [gm.GraphUtil.__hash_md5__(_.name) for _ in v]
-                                                      for k, v in stacktrace_manager.node_stacktrace.items()}
-        json_stacktrace_manager['freq_stacktrace'] = stacktrace_manager.freq_stacktrace
-        json_stacktrace_manager['uuid_nodes_map'] = {k: [gm.GraphUtil.__hash_md5__(_.name) for _ in v]
-                                                     for k, v in stacktrace_manager.uuid_nodes_map.items()}
+        json_stacktrace_manager['uuid'] = stacktrace_manager.uuid.to_array().tolist()
+        node_stacktrace = [stacktrace_manager.get_frames(id_stacktrace).tolist()
+                           for id_stacktrace in range(len(stacktrace_manager))]
+        json_stacktrace_manager['stacktrace'] = {stacktrace_hash_ids[k]: [node_manager.frame_dictionary.names[_]
+                                                                          for _ in v]
+                                                 for k, v in enumerate(node_stacktrace)}
+        json_stacktrace_manager['node_stacktrace'] = {stacktrace_hash_ids[k]: [frame_hash_ids[_] for _ in v]
+                                                      for k, v in enumerate(node_stacktrace)}
+        json_stacktrace_manager['freq_stacktrace'] = {stacktrace_hash_ids[k]: v for k, v in
+                                                      enumerate(stacktrace_manager.freq_stacktrace.view().tolist())}
+        json_stacktrace_manager['uuid_nodes_map'] = {k: json_stacktrace_manager['node_stacktrace'][
+                                                         stacktrace_hash_ids[v]]
+                                                     for k, v in stacktrace_manager.uuid_items()}
         # Update json object
         parent_json_object['node_pool'] = json_obj_nodes
         parent_json_object['stacktrace_manager'] = json_stacktrace_manager
@@ -72,6 +87,9 @@ class GraphSaver:
             logger.info('Storing Graph with {} into pickle format file'.
                         format(len(graph_manager.node_manager.pool.keys())))
             start = datetime.now()
+            graph_manager.node_manager.compact()
+            if g_conf.GraphEnvVar.LSH_CANDIDATES:
+                graph_manager.stacktrace_manager.index_stacktraces()
             file = open(file_path, 'wb')
             pickle.dump(graph_manager, file, pickle.HIGHEST_PROTOCOL)
             file.close()
@@ -0,0 +1,135 @@
+import numpy as np
+
+
+class AdjacencyStore:
+    """
+    Array-backed adjacency counts in CSR layout
+    Row `src` owns neighbors[offsets[src]:offsets[src + 1]] (sorted) and their counts. New counts land in a delta
+    buffer, a dict-of-dicts for single pairs and a list of COO arrays for batches, which is merged into the CSR arrays
+    once it holds `delta_size` entries. A merge sorts the delta only and inserts it into the sorted store in one
+    linear pass, so a chunk costs O(chunk log chunk) amortized whatever the size of the graph
+    """
+    def __init__(self, delta_size=100000):
+        self.delta_size = delta_size
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.neighbors = np.zeros(0, dtype=np.int32)
+        self.counts = np.zeros(0, dtype=np.int32)
+        self.delta = {}
+        self.batches = []
+        self.num_delta = 0
+
+    def __setstate__(self, state):
+        # Stores pickled before batches were buffered have no batch buffer
+        self.__dict__.update(state)
+        self.__dict__.setdefault('batches', [])
+
+    @staticmethod
+    def count_pairs(src, dst, weights=None):
+        src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+        if src.size == 0:
+            return src, dst, src
+        stride = int(dst.max()) + 1
+        if weights is None:
+            keys, counts = np.unique(src * stride + dst, return_counts=True)
+        else:
+            keys, inverse = np.unique(src * stride + dst, return_inverse=True)
+            counts = np.bincount(inverse, weights=weights, minlength=len(keys)).astype(np.int64)
+        return keys // stride, keys % stride, counts
+
+    @property
+    def num_rows(self):
+        return len(self.offsets) - 1
+
+    def add(self, src, dst, count=1):
+        row = self.delta.get(src)
+        if row is None:
+            row = self.delta[src] = {}
+        if dst not in row:
+            self.num_delta += 1
+        row[dst] = row.get(dst, 0) + count
+        if self.num_delta >= self.delta_size:
+            self.compact()
+
+    def add_batch(self, src, dst, counts):
+        assert len(src) == len(dst) == len(counts), \
+            "Mismatched shape between {}, {} and {}".format(len(src), len(dst), len(counts))
+        if len(src) > 0:
+            self.batches.append((np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64),
+                                 np.asarray(counts, dtype=np.int64)))
+            self.num_delta += len(src)
+            if self.num_delta >= self.delta_size:
+                self.compact()
+
+    def compact(self):
+        if self.num_delta == 0:
+            return
+        num_pairs = sum(len(row) for row in self.delta.values())
+        src = np.fromiter((s for s, row in self.delta.items() for _ in row), dtype=np.int64, count=num_pairs)
+        dst = np.fromiter((d for row in self.delta.values() for d in row.keys()), dtype=np.int64, count=num_pairs)
+        counts = np.fromiter((c for row in self.delta.values() for c in row.values()), dtype=np.int64,
+                             count=num_pairs)
+        batches = [(src, dst, counts)] + self.batches
+        self.delta = {}
+        self.batches = []
+        self.num_delta = 0
+        self.__merge__(*(np.concatenate(columns) for columns in zip(*batches)))
+
+    def __merge__(self, src, dst, counts):
+        if len(src) == 0:
+            return
+        num_rows = max(self.num_rows, int(src.max()) + 1)
+        stride = max(int(dst.max()), int(self.neighbors.max(initial=-1))) + 1
+        # Reduce duplicated (src, dst) pairs of the delta on a combined int64 key, only the delta is sorted
+        delta_keys, inverse = np.unique(src * stride + dst, return_inverse=True)
+        delta_counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(delta_keys)).astype(np.int64)
+
+        # Keys of the store are sorted already (CSR order), existing pairs are incremented in place and new pairs
+        # inserted at their sorted position
+        rows = np.repeat(np.arange(self.num_rows, dtype=np.int64), np.diff(self.offsets))
+        keys = rows * stride + self.neighbors
+        positions = np.searchsorted(keys, delta_keys)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == delta_keys[found]
+        counts = self.counts.astype(np.int64)
+        counts[positions[found]] += delta_counts[found]
+        new_keys = delta_keys[~found]
+        self.neighbors = np.insert(self.neighbors, positions[~found], (new_keys % stride).astype(np.int32))
+        self.counts = np.insert(counts, positions[~found], delta_counts[~found]).astype(np.int32)
+        row_sizes = np.bincount(new_keys // stride, minlength=num_rows)
+        row_sizes[:self.num_rows] += np.diff(self.offsets)
+        self.offsets = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(row_sizes, out=self.offsets[1:])
+
+    def row(self, src):
+        if src < self.num_rows:
+            start, end = self.offsets[src], self.offsets[src + 1]
+            neighbors, counts = self.neighbors[start:end], self.counts[start:end]
+        else:
+            neighbors, counts = self.neighbors[:0], self.counts[:0]
+        pending = self.delta.get(src)
+        pending_batches = [(batch_dst[batch_src == src], batch_counts[batch_src == src])
+                           for batch_src, batch_dst, batch_counts in self.batches]
+        if pending or any(len(batch_dst) > 0 for batch_dst, _ in pending_batches):
+            pending = pending or {}
+            neighbors = np.concatenate([neighbors, np.fromiter(pending.keys(), dtype=np.int32, count=len(pending))]
+                                       + [batch_dst.astype(np.int32) for batch_dst, _ in pending_batches])
+            counts = np.concatenate([counts, np.fromiter(pending.values(), dtype=np.int32, count=len(pending))]
+                                    + [batch_counts.astype(np.int32) for _, batch_counts in pending_batches])
+            neighbors, inverse = np.unique(neighbors, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts, minlength=len(neighbors)).astype(np.int32)
+        return neighbors, counts
+
+    def row_dict(self, src):
+        neighbors, counts = self.row(src)
+        return dict(zip(neighbors.tolist(), counts.tolist()))
+
+    def to_coo(self):
+        self.compact()
+        rows = np.repeat(np.arange(self.num_rows, dtype=np.int32), np.diff(self.offsets))
+        return rows, self.neighbors, self.counts
+
+    def transpose(self):
+        rows, neighbors, counts = self.to_coo()
+        transposed = AdjacencyStore(self.delta_size)
+        transposed.add_batch(neighbors, rows, counts)
+        return transposed
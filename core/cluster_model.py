@@ -0,0 +1,107 @@
+import pickle
+import numpy as np
+from graph.build import graph_configure as g_conf
+from graph.core import graph_manager as gm
+from graph.core.columnar import GrowableArray
+from graph.core.matrix import MatrixCalculation
+from graph.core.deduplication import StacktraceDeduplicator
+
+
+class ClusterModel:
+    """
+    Persisted leader-clustering model for incremental assignment
+    Every cluster keeps the frame set of its pivot as representative, an inverted index from frame IDs to the
+    clusters containing them scores a new stacktrace against the clusters it shares frames with only
+    """
+    def __init__(self, cluster_sim_threshold=None):
+        self.cluster_sim_threshold = g_conf.GraphEnvVar.CLUSTER_SIM_THRESHOLD if cluster_sim_threshold is None \
+            else cluster_sim_threshold
+        self.frame_dictionary = gm.FrameDictionary()
+        self.postings = {}
+        self.cluster_ids = GrowableArray(np.int64)
+        self.representative_sizes = GrowableArray(np.int64)
+        self.sizes = GrowableArray(np.int64)
+
+    def __len__(self):
+        return len(self.cluster_ids)
+
+    def __frame_set__(self, stacktrace):
+        return np.unique(np.array(self.frame_dictionary.intern_stacktrace(stacktrace), dtype=np.int64))
+
+    def __open_cluster__(self, cluster_id, frame_ids, size):
+        index = len(self.cluster_ids)
+        for frame_id in frame_ids.tolist():
+            self.postings.setdefault(frame_id, []).append(index)
+        self.cluster_ids.append(cluster_id)
+        self.representative_sizes.append(len(frame_ids))
+        self.sizes.append(size)
+        return index
+
+    def __next_cluster_id__(self):
+        return int(self.cluster_ids.view().max()) + 1 if len(self) > 0 else 0
+
+    def __closest__(self, frame_ids):
+        # Overlap with every cluster sharing a frame, cosine of binary frame sets is overlap / sqrt(|q| |r|)
+        postings = [self.postings[frame_id] for frame_id in frame_ids.tolist() if frame_id in self.postings]
+        if len(postings) == 0:
+            return -1
+        candidates, overlaps = np.unique(np.concatenate(postings), return_counts=True)
+        scores = overlaps / np.sqrt(len(frame_ids) * self.representative_sizes[candidates])
+        best = np.argmax(scores)
+        return candidates[best] if MatrixCalculation.above_threshold(scores[best], self.cluster_sim_threshold) else -1
+
+    def fit(self, list_stacktrace, clusterid_docids_map):
+        """
+        Reset the model from a clustering result, the first doc of every cluster is its representative
+        Abnormal ('other') and noise (-1) groups do not open clusters
+        """
+        self.__init__(self.cluster_sim_threshold)
+        for clusterid, docids in clusterid_docids_map.items():
+            if clusterid == 'other' or clusterid == -1 or len(docids) == 0:
+                continue
+            self.__open_cluster__(int(clusterid), self.__frame_set__(list_stacktrace[docids[0]]), len(docids))
+        return self
+
+    def update(self, list_stacktrace, clusterid_docids_map):
+        """
+        Merge a clustering result into the model, every cluster joins the closest existing cluster through its first
+        doc, or opens a new one, so earlier clusters and their IDs are kept
+        :return: Map from cluster IDs of the clustering result to cluster IDs of the model
+        """
+        clusterid_model_map = {}
+        for clusterid, docids in clusterid_docids_map.items():
+            if clusterid == 'other' or clusterid == -1 or len(docids) == 0:
+                continue
+            frame_ids = self.__frame_set__(list_stacktrace[docids[0]])
+            index = self.__closest__(frame_ids)
+            if index < 0:
+                index = self.__open_cluster__(self.__next_cluster_id__(), frame_ids, 0)
+            self.sizes[index] += len(docids)
+            clusterid_model_map[clusterid] = int(self.cluster_ids[index])
+        return clusterid_model_map
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as file:
+            pickle.dump(self, file, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(file_path):
+        with open(file_path, 'rb') as file:
+            return pickle.load(file)
+
+    def assign(self, list_stacktrace):
+        """
+        Map stacktraces to the closest existing cluster, or open a new cluster led by the stacktrace when none
+        reaches the similarity threshold
+        :return: Cluster IDs of every stacktrace
+        """
+        dedup = StacktraceDeduplicator().fit(list_stacktrace)
+        labels = np.empty(len(dedup.unique_stacktrace), dtype=np.int64)
+        for i, stacktrace in enumerate(dedup.unique_stacktrace):
+            frame_ids = self.__frame_set__(stacktrace)
+            index = self.__closest__(frame_ids)
+            if index < 0:
+                index = self.__open_cluster__(self.__next_cluster_id__(), frame_ids, 0)
+            self.sizes[index] += dedup.counts[i]
+            labels[i] = self.cluster_ids[index]
+        return dedup.expand(labels)
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+class GrowableArray:
+    """
+    Append-only NumPy column with amortized capacity doubling
+    Views returned by `view` are only valid until the next append
+    """
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, item):
+        return self.data[:self.size][item]
+
+    def __setitem__(self, item, value):
+        self.data[:self.size][item] = value
+
+    def __reserve__(self, size):
+        if size > len(self.data):
+            data = np.zeros(max(size, 2 * len(self.data)), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self, value):
+        self.__reserve__(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        self.__reserve__(self.size + len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def view(self):
+        return self.data[:self.size]
+
+    def __getstate__(self):
+        return {'data': self.data[:self.size].copy()}
+
+    def __setstate__(self, state):
+        self.data = state['data']
+        self.size = len(self.data)
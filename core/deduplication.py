@@ -0,0 +1,47 @@
+import numpy as np
+
+
+class StacktraceDeduplicator:
+    """
+    Content-addressed collapse of a batch of stacktraces into unique stacktraces with multiplicity counts
+    Uniques keep the order of their first occurrence, `inverse` maps every record back to its unique stacktrace
+    """
+    def __init__(self):
+        self.unique_stacktrace = []
+        self.counts = None
+        self.first_index = None
+        self.inverse = None
+
+    def fit(self, list_stacktrace):
+        stacktrace_index = {}
+        first_index = []
+        self.unique_stacktrace = []
+        self.inverse = np.empty(len(list_stacktrace), dtype=np.int64)
+        for i, stacktrace in enumerate(list_stacktrace):
+            key = tuple(stacktrace)
+            unique_id = stacktrace_index.get(key)
+            if unique_id is None:
+                unique_id = stacktrace_index[key] = len(self.unique_stacktrace)
+                self.unique_stacktrace.append(stacktrace)
+                first_index.append(i)
+            self.inverse[i] = unique_id
+        self.first_index = np.array(first_index, dtype=np.int64)
+        self.counts = np.bincount(self.inverse, minlength=len(self.unique_stacktrace))
+        return self
+
+    @property
+    def duplication_ratio(self):
+        return len(self.inverse) / max(len(self.unique_stacktrace), 1)
+
+    def first_of(self, values):
+        return [values[i] for i in self.first_index]
+
+    def expand(self, unique_values):
+        return np.asarray(unique_values)[self.inverse]
+
+    def expand_groups(self, clusterid_docids_map):
+        # Original docids of every unique stacktrace, grouped by a stable sort on the inverse mapping
+        order = np.argsort(self.inverse, kind='stable')
+        unique_docids = np.split(order, np.cumsum(self.counts)[:-1])
+        return {clusterid: np.sort(np.concatenate([unique_docids[docid] for docid in docids])).tolist()
+                for clusterid, docids in clusterid_docids_map.items()}
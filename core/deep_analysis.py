@@ -32,8 +32,11 @@ class DeepAnalysis:
         logger.info('Add "tokenization" attribute {}'.format(datetime.now() - start))
         # Topic Modelling issue #21
         logger.info('Analyze Topic Modelling')
-        sentences = [[_ for node in nodes for _ in node.static_attribute['token']]
-                     for uuid, nodes in graph_manager.stacktrace_manager.uuid_nodes_map.items()]
+        pool = graph_manager.node_manager.pool
+        stacktrace_manager = graph_manager.stacktrace_manager
+        sentences = [[_ for frame_id in stacktrace_manager.get_frames(id_stacktrace).tolist()
+                      for _ in pool[frame_id].static_attribute['token']]
+                     for uuid, id_stacktrace in stacktrace_manager.uuid_items()]
         topic_model = TopicModelling()
         topic_model.apply_lda(sentences)
 
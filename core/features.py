@@ -0,0 +1,63 @@
+import numpy as np
+from scipy import sparse
+
+
+class HashedNgramFeatures:
+    """
+    Order-aware stacktrace features with the hashing trick
+    Every run of `n` consecutive frames (n in [min_n, max_n]) of a stacktrace is hashed into one of `n_features`
+    columns, unigrams are frame membership and bigrams are the frame-to-frame transitions of the graph's out edges
+    The width is fixed, so memory stays flat however large the node pool grows
+    """
+    # 64-bit multiplicative hashing constants (splitmix64), arithmetic wraps around in uint64
+    MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+    MIX = np.uint64(0xBF58476D1CE4E5B9)
+
+    def __init__(self, n_features=2 ** 14, max_n=2, min_n=1, binary=True):
+        assert min_n >= 1 and max_n >= min_n, "Invalid n-gram range"
+        self.n_features = n_features
+        self.min_n = min_n
+        self.max_n = max_n
+        self.binary = binary
+
+    def __hash_ngrams__(self, frame_ids, trace_index, n):
+        # Windows of n frames starting at every position, kept when they stay inside one stacktrace and every frame
+        # is known to the graph (unknown frames are looked up as -1)
+        num_windows = len(frame_ids) - n + 1
+        if num_windows <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        valid = trace_index[:num_windows] == trace_index[n - 1:]
+        hashes = np.full(num_windows, n, dtype=np.uint64)
+        for k in range(n):
+            window = frame_ids[k:k + num_windows]
+            valid &= window >= 0
+            hashes = hashes * HashedNgramFeatures.MULTIPLIER + window.astype(np.uint64)
+        hashes ^= hashes >> np.uint64(31)
+        hashes *= HashedNgramFeatures.MIX
+        hashes ^= hashes >> np.uint64(29)
+        return trace_index[:num_windows][valid], (hashes[valid] % np.uint64(self.n_features)).astype(np.int64)
+
+    def transform(self, frame_ids, lengths):
+        """
+        :param frame_ids: Flat frame IDs of every stacktrace in order, -1 for unknown frames
+        :param lengths: Number of frames of every stacktrace
+        :return: Sparse CSR feature matrix of shape [n, n_features]
+        """
+        frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        trace_index = np.repeat(np.arange(len(lengths)), lengths)
+        with np.errstate(over='ignore'):
+            rows, columns = zip(*[self.__hash_ngrams__(frame_ids, trace_index, n)
+                                  for n in range(self.min_n, self.max_n + 1)])
+        rows, columns = np.concatenate(rows), np.concatenate(columns)
+        features = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                                     shape=(len(lengths), self.n_features))
+        features.sum_duplicates()
+        if self.binary:
+            features.data[:] = 1
+        return features
+
+    def transform_stacktraces(self, list_frame_ids):
+        lengths = [len(frame_ids) for frame_ids in list_frame_ids]
+        frame_ids = np.concatenate(list_frame_ids) if len(list_frame_ids) > 0 else np.zeros(0, dtype=np.int64)
+        return self.transform(frame_ids, lengths)
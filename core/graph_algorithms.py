@@ -1,6 +1,18 @@
-from sklearn.feature_extraction import text
+from abc import ABC, abstractmethod
 from sklearn import cluster
+from sklearn import neighbors
+from datetime import datetime
+import tracemalloc
 import numpy as np
+from scipy import sparse
+from graph.build import graph_configure as g_conf
+from graph.core.deduplication import StacktraceDeduplicator
+from graph.core.lsh import MinHashLSH
+from graph.core.matrix import MatrixCalculation
+from graph.core.merge_tree import MergeTree
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
 
 class SparseMatrixClustering:
@@ -11,36 +23,40 @@ class SparseMatrixClustering:
         self.clusterid_docids_mapping = None
         self.min_samples = 3
         self.abnormaly_detection = True
+        self.sample_weight = None
         self.labels_ = None
 
-    def fit(self, x):
-        self.score_mat = self.graph_manager.compare_ohv_stacktrace(x)
+    def fit(self, x, sample_weight=None, candidate_pairs=None):
+        self.sample_weight = np.ones(x.shape[0], dtype=np.int64) if sample_weight is None else sample_weight
+        # Sparse neighbor graph holding only the pairs at or above the similarity threshold
+        self.score_mat = self.graph_manager.compare_ohv_stacktrace(x, threshold=self.cluster_sim_threshold,
+                                                                   candidate_pairs=candidate_pairs)
         self.clusterid_docids_mapping = self.__cluster__(self.score_mat)
         self.clusterid_docids_mapping = self.__exclude_abnormaly__(self.clusterid_docids_mapping)
         self.__relabel__(self.clusterid_docids_mapping)
 
     def __cluster__(self, score_mat):
-        doc_ids = list(range(score_mat.shape[0]))
+        # Greedy leader clustering: the lowest unassigned doc becomes a pivot and claims every unassigned neighbor,
+        # so each pivot only touches its own CSR row instead of rescanning the remaining docs
+        num_docs = score_mat.shape[0]
+        indptr, indices = score_mat.indptr, score_mat.indices
+        labels = np.full(num_docs, -1, dtype=np.int64)
         clusterid = 0
-        clusterid_docids_mapping = {}
-        while len(doc_ids) > 0:
-            pivot = doc_ids[0]
-            sub = [doc_id for doc_id in doc_ids if doc_id != pivot]
-            clusterid_docids_mapping[clusterid] = [pivot]
-            doc_ids.remove(pivot)
-            for doc_id in sub:
-                if score_mat[pivot][doc_id] >= self.cluster_sim_threshold:
-                    clusterid_docids_mapping[clusterid].append(doc_id)
-                    doc_ids.remove(doc_id)
+        for pivot in range(num_docs):
+            if labels[pivot] >= 0:
+                continue
+            neighbors = indices[indptr[pivot]:indptr[pivot + 1]]
+            labels[neighbors[labels[neighbors] < 0]] = clusterid
+            labels[pivot] = clusterid
             clusterid += 1
-        return clusterid_docids_mapping
+        return MatrixCalculation.group_labels(labels)
 
     def __exclude_abnormaly__(self, clusterid_docids_mapping):
         if self.abnormaly_detection:
             other = []
             abnormal_keys = []
             for k, v in clusterid_docids_mapping.items():
-                if len(v) <= self.min_samples:
+                if np.sum(self.sample_weight[v]) <= self.min_samples:
                     other += v
                     abnormal_keys.append(k)
             for k in abnormal_keys:
@@ -52,11 +68,97 @@ class SparseMatrixClustering:
     def __relabel__(self, clusterid_docids_map):
         self.labels_ = np.zeros(self.score_mat.shape[0])
         for clusterid, docids in clusterid_docids_map.items():
-            for docid in docids:
-                if clusterid != 'other':
-                    self.labels_[docid] = clusterid
-                else:
-                    self.labels_[docid] = -1
+            self.labels_[docids] = clusterid if clusterid != 'other' else -1
+
+
+CLUSTERING_BACKENDS = {}
+
+
+def register_backend(name):
+    def register(backend_class):
+        CLUSTERING_BACKENDS[name] = backend_class
+        return backend_class
+    return register
+
+
+class ClusteringBackend(ABC):
+    """
+    Clustering algorithm working on the sparse one-hot matrix of unique stacktraces weighted by multiplicity
+    `profile_fit` records the wall time of the fit, and its peak traced memory when `trace_memory` is set, so
+    backends can be compared; tracing slows allocations down, so it is off by default
+    """
+    def __init__(self, graph_manager):
+        self.graph_manager = graph_manager
+        self.labels_ = None
+        self.clusterid_docids_mapping = None
+        self.score_mat = None
+        self.merge_tree = None
+        self.elapsed = None
+        self.peak_memory = None
+
+    @abstractmethod
+    def fit(self, x, sample_weight, candidate_pairs=None):
+        pass
+
+    def profile_fit(self, x, sample_weight, candidate_pairs=None, trace_memory=False):
+        started = trace_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+        start = datetime.now()
+        self.fit(x, sample_weight, candidate_pairs)
+        self.elapsed = datetime.now() - start
+        if trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+        if started:
+            tracemalloc.stop()
+        return self
+
+
+@register_backend('k-mean')
+class MiniBatchKMeansBackend(ClusteringBackend):
+    def fit(self, x, sample_weight, candidate_pairs=None):
+        n_clusters = min(g_conf.GraphEnvVar.KMEANS_N_CLUSTERS, x.shape[0])
+        batch_size = max(g_conf.GraphEnvVar.KMEANS_BATCH_SIZE, n_clusters)
+        kmeans = cluster.MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, n_init=3)
+        # Mini-batch epochs over the sparse matrix, never densified, until the centers settle
+        kmeans.fit(x, sample_weight=sample_weight)
+        self.labels_ = kmeans.labels_
+        self.clusterid_docids_mapping = MatrixCalculation.group_labels(self.labels_)
+
+
+@register_backend('dbscan')
+class DBSCANBackend(ClusteringBackend):
+    def fit(self, x, sample_weight, candidate_pairs=None):
+        eps = g_conf.GraphEnvVar.DBSCAN_EPS
+        # Sparse radius-neighbors graph, DBSCAN only needs the pairs within eps
+        self.score_mat = neighbors.NearestNeighbors(radius=eps).fit(x).radius_neighbors_graph(x, mode='distance')
+        dbscan = cluster.DBSCAN(eps=eps, min_samples=g_conf.GraphEnvVar.DBSCAN_MIN_SAMPLES, metric='precomputed')
+        dbscan.fit(self.score_mat, sample_weight=sample_weight)
+        self.labels_ = dbscan.labels_
+        self.clusterid_docids_mapping = MatrixCalculation.group_labels(self.labels_)
+
+
+@register_backend('single-linkage')
+class SingleLinkageBackend(ClusteringBackend):
+    def fit(self, x, sample_weight, candidate_pairs=None):
+        # Build the merge tree once down to the lowest explorable threshold, then cut at the configured one
+        self.score_mat = self.graph_manager.compare_ohv_stacktrace(
+            x, threshold=g_conf.GraphEnvVar.MERGE_TREE_MIN_THRESHOLD)
+        self.merge_tree = MergeTree(g_conf.GraphEnvVar.MERGE_TREE_MIN_THRESHOLD).fit(self.score_mat)
+        self.labels_ = self.merge_tree.cut(g_conf.GraphEnvVar.CLUSTER_SIM_THRESHOLD)
+        self.clusterid_docids_mapping = self.merge_tree.cut_groups(g_conf.GraphEnvVar.CLUSTER_SIM_THRESHOLD)
+
+
+@register_backend('default')
+class LeaderBackend(ClusteringBackend):
+    def fit(self, x, sample_weight, candidate_pairs=None):
+        sm_cluster = SparseMatrixClustering(cluster_sim_threshold=g_conf.GraphEnvVar.CLUSTER_SIM_THRESHOLD,
+                                            graph_manager=self.graph_manager)
+        sm_cluster.fit(x, sample_weight=sample_weight, candidate_pairs=candidate_pairs)
+        self.score_mat = sm_cluster.score_mat
+        self.labels_ = sm_cluster.labels_
+        self.clusterid_docids_mapping = sm_cluster.clusterid_docids_mapping
 
 
 class GraphClusteringAlgorithms:
@@ -64,45 +166,72 @@ class GraphClusteringAlgorithms:
         self.algorithms = algorithms
         self.balanace_weights = balance_weights
         self.graph_manager = graph_manager
-        self.tfidf_vec = None
+        self.idf_weights = None
         self.clusterid_docids_map = None
         self.ohv_stacktrace = None
         self.labels = None
+        self.dedup = None
+        self.merge_tree = None
+        self.score_mat = None
+        self.backend = None
 
     @staticmethod
     def preprocess(x):
         return [' '.join(stacktrace) for stacktrace in x]
 
-    def __rebalance_weights__(self, x):
+    def __rebalance_weights__(self, x, node_pool):
+        # IDF from the graph's counts scales a copy of the stored entries, the new matrix shares the index arrays
         if self.balanace_weights is True:
-            self.tfidf_vec = text.TfidfVectorizer()
-            return self.tfidf_vec.fit_transform(x).toarray()
+            self.idf_weights = self.graph_manager.get_idf_weights(node_pool)
+            return sparse.csr_matrix((x.data * self.idf_weights[x.indices], x.indices, x.indptr), shape=x.shape)
         return x
 
-    def __apply_cluster_algorithms__(self, x):
-        if self.algorithms == 'k-mean':
-            kmeans = cluster.KMeans(n_clusters=3)
-            kmeans.fit(x)
-            self.labels = kmeans.labels_
-            for i, label in enumerate(kmeans.labels_):
-                self.clusterid_docids_map[label] = self.clusterid_docids_map.get(label, []) + [i]
-        elif self.algorithms == 'dbscan':
-            dbscan = cluster.DBSCAN(eps=2, min_samples=3)
-            dbscan.fit(x)
-            self.labels = dbscan.labels_
-            for i, label in enumerate(dbscan.labels_):
-                self.clusterid_docids_map[label] = self.clusterid_docids_map.get(label, []) + [i]
-        else:
-            sm_cluster = SparseMatrixClustering(cluster_sim_threshold=0.8, graph_manager=self.graph_manager)
-            sm_cluster.fit(x)
-            self.score_mat = sm_cluster.score_mat
-            self.clusterid_docids_map = sm_cluster.clusterid_docids_mapping
+    def __candidate_pairs__(self, x):
+        # MinHash/LSH narrows the exact similarity join to pairs sharing a band bucket
+        if not g_conf.GraphEnvVar.LSH_CANDIDATES or self.algorithms != 'default':
+            return None
+        lsh = MinHashLSH(g_conf.GraphEnvVar.LSH_NUM_PERM, g_conf.GraphEnvVar.LSH_NUM_BANDS,
+                         max_bucket_size=g_conf.GraphEnvVar.LSH_MAX_BUCKET_SIZE)
+        return lsh.candidate_pairs(lsh.signatures(x.indices, x.indptr))
 
+    def __apply_cluster_algorithms__(self, x, sample_weight):
+        backend_class = CLUSTERING_BACKENDS.get(self.algorithms, CLUSTERING_BACKENDS['default'])
+        self.backend = backend_class(self.graph_manager)
+        self.backend.profile_fit(x, sample_weight, candidate_pairs=self.__candidate_pairs__(x),
+                                 trace_memory=g_conf.GraphEnvVar.PROFILE_MEMORY)
+        if self.backend.peak_memory is None:
+            logger.info('Clustering backend "{}" within {}'.format(self.algorithms, self.backend.elapsed))
+        else:
+            logger.info('Clustering backend "{}" within {} at peak {} bytes'.
+                        format(self.algorithms, self.backend.elapsed, self.backend.peak_memory))
+        self.score_mat = self.backend.score_mat
+        self.merge_tree = self.backend.merge_tree
+        self.labels = self.backend.labels_
+        self.clusterid_docids_map = self.backend.clusterid_docids_mapping
 
     def fit(self, x):
-        node_pool, self.ohv_stacktrace = self.graph_manager.__convert_to_ohv__(x)
-        # if self.algorithms != 'default':
-        #     x = self.preprocess(x)
-        #     x = self.__rebalance_weights__(x)
-        self.__apply_cluster_algorithms__(self.ohv_stacktrace)
+        # Cluster unique stacktraces weighted by multiplicity, then expand labels back to every document
+        self.dedup = StacktraceDeduplicator().fit(x)
+        hashed_features = g_conf.GraphEnvVar.init_features()
+        if hashed_features is not None:
+            # Order-aware hashed n-grams replace frame membership, IDF over frames does not apply to hashed columns
+            x = hashed_features.transform(*self.graph_manager.node_manager.frame_dictionary.lookup_stacktraces(
+                self.dedup.unique_stacktrace))
+        else:
+            node_pool, ohv_unique_stacktrace = self.graph_manager.__convert_to_ohv__(self.dedup.unique_stacktrace)
+            x = self.__rebalance_weights__(ohv_unique_stacktrace, node_pool)
+        self.__apply_cluster_algorithms__(x, self.dedup.counts)
+        # The matrix clustered, one row per document
+        self.ohv_stacktrace = x[self.dedup.inverse]
+        self.labels = self.dedup.expand(self.labels)
+        self.clusterid_docids_map = self.dedup.expand_groups(self.clusterid_docids_map)
         # return x
+
+    def cut(self, threshold):
+        """
+        Re-label the fitted documents at another similarity threshold from the single-linkage merge tree
+        """
+        assert self.merge_tree is not None, "Only available after fitting with 'single-linkage' algorithms"
+        self.labels = self.dedup.expand(self.merge_tree.cut(threshold))
+        self.clusterid_docids_map = self.dedup.expand_groups(self.merge_tree.cut_groups(threshold))
+        return self.labels
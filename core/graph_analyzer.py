@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from bigdata.core import bigdata
 from graph.core import report
@@ -5,6 +6,7 @@ from datetime import datetime
 from database import data_retriever
 from graph import util
 from graph.core import graph_algorithms as g_alg
+from graph.build import graph_configure as g_conf
 from graph.core.graph_evaluation import Evaluation
 import logging
 logger = logging.getLogger(__name__)
@@ -20,9 +22,9 @@ class GraphAnalyzer:
         self.deep_analyze = deep_analyze
         self.graph_algorithms = None
 
-    def analyze_bundle(self, data_bundles, one_shot=False):
+    def analyze_bundle(self, data_bundles, one_shot=False, run_id=None):
         if one_shot is False:
-            return self.__analyze_generator__(data_bundles)
+            return self.__analyze_generator__(data_bundles, run_id)
         uuid, error_logs = data_bundles
         return self.__analyze_one_shot__(uuid, error_logs)
 
@@ -49,9 +51,14 @@ class GraphAnalyzer:
 
         # Apply graph algorithms
         self.graph_algorithms = g_alg.GraphClusteringAlgorithms(algorithms=self.algorithms,
-                                                                balance_weights=False,
+                                                                balance_weights=g_conf.GraphEnvVar.BALANCE_WEIGHTS,
                                                                 graph_manager=self.graph_builder.graph_manager)
         self.graph_algorithms.fit(list_stacktrace)
+        # Merge the clusters into the persisted cluster model so later logs are assigned to stable cluster IDs
+        graph_manager = self.graph_builder.graph_manager
+        clusterid_model_map = graph_manager.cluster_model.update(list_stacktrace,
+                                                                 self.graph_algorithms.clusterid_docids_map)
+        graph_manager.save_cluster_model()
 
         cluster_report = report.ClusterReport()
         cluster_report.cluster_algorithms = self.algorithms
@@ -59,6 +66,7 @@ class GraphAnalyzer:
         data_report.one_hot_vector = self.graph_algorithms.ohv_stacktrace
         cluster_report.labels = self.graph_algorithms.labels
         cluster_report.clusterid_docids_map = self.graph_algorithms.clusterid_docids_map
+        cluster_report.clusterid_model_map = clusterid_model_map
         cluster_report.gather_report()
         cluster_report.evaluation_report = Evaluation.generate_evaluation_report(self.graph_parser,
                                                                                  data_report.valid_error_logs,
@@ -66,13 +74,61 @@ class GraphAnalyzer:
         return report.Report(data_report=data_report,
                              cluster_report=cluster_report)
 
-    def __analyze_generator__(self, generator):
+    def assign(self, error_logs):
+        """
+        Assign error logs to the clusters of the persisted cluster model, opening new clusters when needed
+        :return: Cluster ID of every error log, -1 for invalid error logs
+        """
+        assert error_logs is not None and len(error_logs) > 0, 'Data must not be empty'
+        error_logs = pd.Series(error_logs) if isinstance(error_logs, list) else error_logs
+        list_stacktrace, valid_indices, excluded_indices = self.graph_parser.validate(error_logs)
+        labels = np.full(len(error_logs), -1, dtype=np.int64)
+        labels[list(valid_indices)] = self.graph_builder.graph_manager.cluster_model.assign(list_stacktrace)
+        return labels
+
+    def resume(self, generator, run_id):
+        """
+        Resume an interrupted big-data analysis over the same generator, checkpointed chunks and similarity blocks
+        of the run are skipped
+        """
+        assert bigdata.BigDataRunManifest(run_id).exists(), "No checkpoint of run {}".format(run_id)
+        return self.__analyze_generator__(generator, run_id)
+
+    @staticmethod
+    def purge(run_id):
+        bigdata.BigDataClusterring.purge(run_id)
+
+    def __analyze_generator__(self, generator, run_id=None):
         logger.info('STEP 1/3: LOOKUP ONE-HOT-VECTOR')
         start = datetime.now()
         assert self.graph_builder.graph_manager.get_total_node_pool() > 0, "No nodes at all, please check Graph Version"
-        bigdata_cluster = bigdata.BigDataClusterring(0.8, self.graph_builder.graph_manager.get_all_node_pool())
+        # A run ID without checkpoint names a new run, one with a checkpoint resumes it
+        if run_id is not None and bigdata.BigDataRunManifest(run_id).exists():
+            bigdata_cluster = bigdata.BigDataClusterring.resume(run_id,
+                                                                self.graph_builder.graph_manager.get_all_node_pool(),
+                                                                features=g_conf.GraphEnvVar.init_features())
+        else:
+            bigdata_cluster = bigdata.BigDataClusterring(g_conf.GraphEnvVar.CLUSTER_SIM_THRESHOLD,
+                                                         self.graph_builder.graph_manager.get_all_node_pool(),
+                                                         features=g_conf.GraphEnvVar.init_features(),
+                                                         run_id=run_id)
+        try:
+            self.__cluster_generator__(bigdata_cluster, generator)
+        except Exception as error:
+            # Temporary data of a failed run is kept, the error carries the run ID to resume it with
+            error.run_id = bigdata_cluster.run_id
+            raise
+        finally:
+            bigdata_cluster.wipe_out()
+        logger.info('Analyze big data within {}'.format(datetime.now() - start))
+        return bigdata_cluster.bigdata_report
+
+    def __cluster_generator__(self, bigdata_cluster, generator):
         logger.info('Iterating over data')
         for idx, (data) in enumerate(generator):
+            if bigdata_cluster.has_chunk(idx):
+                logger.info('--- Skip chunk {} checkpointed already'.format(idx + 1))
+                continue
             uuid, error_logs, static_attributes = data_retriever.DataRetriever.get_only_necessary_data(data)
             logger.info('--- Iterate chunk {}'.format(idx + 1))
             error_logs = pd.Series(error_logs) if isinstance(error_logs, list) else error_logs
@@ -82,12 +138,9 @@ class GraphAnalyzer:
             valid_uuids = [docid_uuid_map[idx] for idx in valid_indices]
             if len(valid_uuids) == 0:
                 continue
-            bigdata_cluster.add(idx, valid_uuids, [self.graph_builder.graph_manager.convert_hash_stacktrace(stacktrace)
+            bigdata_cluster.add(idx, valid_uuids, [self.graph_builder.graph_manager.convert_frame_ids(stacktrace)
                                                    for stacktrace in list_stacktrace])
         bigdata_cluster.execute()
-        bigdata_cluster.wipe_out()
-        logger.info('Analyze big data within {}'.format(datetime.now() - start))
-        return bigdata_cluster.bigdata_report
 
     def deep_analyze(self):
         if self.deep_analyze is True:
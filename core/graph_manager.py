@@ -1,8 +1,15 @@
 import numpy as np
+from scipy import sparse
 from datetime import datetime
 import hashlib
 from graph.build import graph_configure as g_conf
 from graph.build import graph_distributor as g_dis
+from graph.core.adjacency import AdjacencyStore
+from graph.core.deduplication import StacktraceDeduplicator
+from graph.core.columnar import GrowableArray
+from graph.core.topk import TopKIndex
+from graph.core.matrix import MatrixCalculation
+from graph.core.lsh import MinHashLSH
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -27,6 +34,8 @@ class GraphManager:
         self.graph_configure = None
         self.node_manager = None
         self.stacktrace_manager = None
+        self.cluster_model = None
+        self.ingestion_progress = None
         self.init_config()
 
     def init_config(self):
@@ -36,6 +45,7 @@ class GraphManager:
             if self.configure is None else self.configure
         self.node_manager = self.graph_configure.graph_loader.node_manager
         self.stacktrace_manager = self.graph_configure.graph_loader.stacktrace_manager
+        self.cluster_model = self.graph_configure.graph_loader.cluster_model
 
     def get_total_node_pool(self):
         return len(self.node_manager.pool.keys())
@@ -47,8 +57,9 @@ class GraphManager:
         if isinstance(uuid, int):
             uuid, data, static_attributes = [uuid], [data], [static_attributes]
         if isinstance(uuid, list):
+            uuid_index = self.stacktrace_manager.uuid
             non_existing = list(zip(*[(_id, _data, _static_attribute) for _id, _data, _static_attribute in
-                                      zip(uuid, data, static_attributes) if _id not in self.stacktrace_manager.uuid]))
+                                      zip(uuid, data, static_attributes) if _id not in uuid_index]))
             return ([], [], []) if len(non_existing) == 0 else (non_existing[0], non_existing[1], non_existing[2])
         return uuid, data, static_attributes
 
@@ -61,6 +72,7 @@ class GraphManager:
             self.__prepare_speed_up__(data, num_data, offset, static_attributes, uuid)
         else:
             self.__prepare_one_shot__(data, num_data, static_attributes, uuid)
+        self.node_manager.compact()
         self.__post_action__()
 
     def __prepare_one_shot__(self, data, num_data, static_attributes, uuid):
@@ -99,12 +111,68 @@ class GraphManager:
         logger.info('Added record {} to {} into Graph within {} - total {} nodes'.
                     format(offset, offset + num_data, datetime.now() - start, self.get_total_node_pool()))
 
+    def ingest(self, records, batch_size=None, memory_budget=None, on_progress=None):
+        """
+        Stream (uuid, stacktrace, static_attribute) records into the Graph by micro-batches
+        A batch is flushed once it holds `batch_size` records or `memory_budget` bytes of raw stacktrace text,
+        so no more than one batch of raw text is held in memory. Managers are kept (not reset) across batches
+        :param records: Iterable of (uuid, stacktrace, static_attribute), stacktrace is a list of methods
+        :param batch_size: Maximum number of records per micro-batch, default GraphEnvVar.CHUNK_SIZE
+        :param memory_budget: Maximum bytes of buffered raw stacktrace text, default GraphEnvVar.INGEST_MEMORY_BUDGET
+        :param on_progress: Optional callback receiving the IngestionProgress after every micro-batch
+        :return: IngestionProgress
+        """
+        batch_size = g_conf.GraphEnvVar.CHUNK_SIZE if batch_size is None else batch_size
+        memory_budget = g_conf.GraphEnvVar.INGEST_MEMORY_BUDGET if memory_budget is None else memory_budget
+        self.ingestion_progress = IngestionProgress()
+        logger.info('Streaming records into Graph by micro-batches of {} records or {} bytes'.
+                    format(batch_size, memory_budget))
+        ids, list_stacktrace, static_attributes, buffered_bytes = [], [], [], 0
+        # IDs of the batch not flushed yet, tracked apart from the Graph's UUIDs until the batch is ingested
+        pending_ids = set()
+        for _id, stacktrace, static_attribute in records:
+            if _id in self.stacktrace_manager.uuid or _id in pending_ids:
+                self.ingestion_progress.num_skipped += 1
+                continue
+            pending_ids.add(_id)
+            ids.append(_id)
+            list_stacktrace.append(stacktrace)
+            static_attributes.append({'static_attribute': None} if static_attribute is None else static_attribute)
+            buffered_bytes += GraphUtil.estimate_size(stacktrace)
+            if len(ids) >= batch_size or buffered_bytes >= memory_budget:
+                self.__ingest_micro_batch__(ids, list_stacktrace, static_attributes, buffered_bytes, on_progress)
+                ids, list_stacktrace, static_attributes, buffered_bytes = [], [], [], 0
+                pending_ids = set()
+        if len(ids) > 0:
+            self.__ingest_micro_batch__(ids, list_stacktrace, static_attributes, buffered_bytes, on_progress)
+        self.node_manager.compact()
+        logger.info('Streamed {} records ({} skipped) into Graph within {} - {:.1f} records/s - total {} nodes'.
+                    format(self.ingestion_progress.num_records, self.ingestion_progress.num_skipped,
+                           self.ingestion_progress.elapsed(), self.ingestion_progress.throughput(),
+                           self.get_total_node_pool()))
+        return self.ingestion_progress
+
+    def __ingest_micro_batch__(self, ids, list_stacktrace, static_attributes, buffered_bytes, on_progress):
+        self.__add_with_speedup__(ids, list_stacktrace, static_attributes)
+        self.ingestion_progress.update(len(ids), sum(len(stacktrace) for stacktrace in list_stacktrace),
+                                       buffered_bytes)
+        logger.info('--- Ingested micro-batch {} - {} records - {:.1f} records/s'.
+                    format(self.ingestion_progress.num_batches, self.ingestion_progress.num_records,
+                           self.ingestion_progress.throughput()))
+        if on_progress is not None:
+            on_progress(self.ingestion_progress)
+
     def save(self):
         self.graph_configure.__post_action__(self)
 
+    def save_cluster_model(self):
+        return self.graph_configure.save_cluster_model(self.cluster_model)
+
     def __add_single_stacktrace__(self, _id, stacktrace, static_attribute):
-        self.node_manager.init_nodes(stacktrace, static_attribute)
-        self.stacktrace_manager.track(self.node_manager.pool, _id, stacktrace)
+        frame_ids = self.node_manager.frame_dictionary.intern_stacktrace(stacktrace)
+        id_stacktrace = self.stacktrace_manager.get_id_stacktrace(frame_ids)
+        self.node_manager.init_nodes(frame_ids, id_stacktrace, static_attribute)
+        self.stacktrace_manager.track(_id, id_stacktrace)
 
     def __add_list_stacktrace__(self, ids, list_stacktrace, static_attributes):
         logger.info('Iteratively adding records into Graph...')
@@ -114,38 +182,104 @@ class GraphManager:
         logger.info('Added {} records into Graph within {}'.format(len(ids), datetime.now() - start))
 
     def __add_with_speedup__(self, ids, list_stacktrace, static_attributes):
-        flatten_methods = [method for method_stacktrace in list_stacktrace for method in method_stacktrace]
-        flatten_static_attributes = [attribute for method_stacktrace in list_stacktrace for attribute in
-                                     [static_attributes] * len(method_stacktrace)]
-        self.node_manager.init_pool(flatten_methods, flatten_static_attributes)
-        self.node_manager.init_edges(list_stacktrace)
-        for _id, stacktrace in zip(ids, list_stacktrace):
-            self.stacktrace_manager.track(self.node_manager.pool, _id, stacktrace)
+        GraphManager.__ingest_batch__(self.node_manager, self.stacktrace_manager,
+                                      ids, list_stacktrace, static_attributes)
 
     @staticmethod
-    def convert_hash_stacktrace(stacktrace):
-        return np.array([GraphUtil.__hash_md5__(method) for method in stacktrace])
+    def __ingest_batch__(node_manager, stacktrace_manager, ids, list_stacktrace, static_attributes):
+        # Duplicated stacktraces are ingested once and weighted by their multiplicity
+        dedup = StacktraceDeduplicator().fit(list_stacktrace)
+        batch = StacktraceBatch(node_manager.frame_dictionary, dedup.unique_stacktrace, dedup.counts)
+        batch.id_stacktrace = np.array([stacktrace_manager.get_id_stacktrace(frame_ids)
+                                        for frame_ids in batch.list_frame_ids], dtype=np.int64)
+        node_manager.init_pool(batch, dedup.first_of(static_attributes))
+        node_manager.init_edges(batch)
+        stacktrace_manager.track_batch(ids, batch, dedup.inverse)
+
+    @staticmethod
+    def build_partial(ids, list_stacktrace, static_attributes=None):
+        """
+        Build a standalone partial graph of one chunk, safe to run in a worker process
+        :return: NodeManager and StacktraceManager to be merged into the master graph by `merge`
+        """
+        static_attributes = [{'static_attribute': None}] * len(ids) if static_attributes is None \
+            else static_attributes
+        node_manager, stacktrace_manager = NodeManager(), StacktraceManager()
+        GraphManager.__ingest_batch__(node_manager, stacktrace_manager, ids, list_stacktrace, static_attributes)
+        node_manager.compact()
+        return node_manager, stacktrace_manager
+
+    def merge(self, node_manager, stacktrace_manager):
+        # Counts add and dictionaries union, so partial graphs can be merged in any order
+        frame_remap = self.node_manager.merge_pool(node_manager)
+        stacktrace_remap = self.stacktrace_manager.merge(stacktrace_manager, frame_remap)
+        self.node_manager.merge_edges(node_manager, frame_remap, stacktrace_remap)
+
+    def add_partials(self, partials, offset=0):
+        start = datetime.now()
+        for node_manager, stacktrace_manager in partials:
+            self.merge(node_manager, stacktrace_manager)
+        self.node_manager.compact()
+        logger.info('Merged {} partial graphs from record {} into Graph within {} - total {} nodes'.
+                    format(len(partials), offset, datetime.now() - start, self.get_total_node_pool()))
+        self.__post_action__()
+
+    def convert_frame_ids(self, stacktrace):
+        return self.node_manager.frame_dictionary.lookup_stacktrace(stacktrace)
 
     def __convert_to_ohv__(self, list_stacktrace):
         start = datetime.now()
-        node_pool = np.array(list(self.node_manager.pool.keys()))
+        node_pool = np.array(list(self.node_manager.pool.keys()), dtype=np.int64)
         logger.info('Lookingup {} records in {} nodes with'.format(len(list_stacktrace), len(node_pool)))
-        ohv_stacktrace = np.array([np.isin(node_pool, GraphManager.convert_hash_stacktrace(stacktrace)).
-                                  astype(np.int32) for stacktrace in list_stacktrace])
+        frame_columns = MatrixCalculation.column_table(node_pool, len(self.node_manager.frame_dictionary))
+        frame_ids, lengths = self.node_manager.frame_dictionary.lookup_stacktraces(list_stacktrace)
+        ohv_stacktrace = MatrixCalculation.one_hot(frame_ids, lengths, frame_columns, len(node_pool))
         logger.info('Lookup {} records in {} nodes with {}'.format(len(list_stacktrace),
                                                                    len(node_pool), datetime.now() - start))
         return node_pool, ohv_stacktrace
 
+    def get_idf_weights(self, node_pool):
+        """
+        Smoothed IDF of frames from the counts already held by the graph, no re-tokenization needed
+        Document frequency of a frame is the number of tracked records whose stacktrace contains it, i.e. the sum of
+        the frequencies of its distinct stacktraces; node weights also count repeated frames and would overestimate it
+        :param node_pool: Frame IDs in column order of the one-hot matrix
+        :return: float64 IDF of every column, log((1 + n) / (1 + df)) + 1
+        """
+        stacktrace_manager = self.stacktrace_manager
+        frames = stacktrace_manager.frames.view().astype(np.int64)
+        trace_index = np.repeat(np.arange(len(stacktrace_manager)), np.diff(stacktrace_manager.offsets.view()))
+        num_frames = len(self.node_manager.frame_dictionary)
+        pairs = np.unique(trace_index * num_frames + frames)
+        freqs = stacktrace_manager.freq_stacktrace.view()
+        doc_freq = np.bincount(pairs % num_frames, weights=freqs[pairs // num_frames], minlength=num_frames) \
+            if num_frames > 0 else np.zeros(0)
+        return np.log((1 + freqs.sum()) / (1 + doc_freq[node_pool])) + 1
+
     @staticmethod
-    def compare_ohv_stacktrace(ohv_stacktrace):
+    def compare_ohv_stacktrace(ohv_stacktrace, threshold=None, top_k=None, candidate_pairs=None):
         logger.info('Shape of one-hot-matrix {}'.format(ohv_stacktrace.shape))
         start = datetime.now()
-        ohv_shape = len(ohv_stacktrace)
+        ohv_shape = ohv_stacktrace.shape[0]
+        if candidate_pairs is not None and threshold is not None:
+            similarity_graph = MatrixCalculation.candidate_similarity(ohv_stacktrace, *candidate_pairs, threshold)
+            logger.info('Verifying {} candidate pairs into {} similar pairs {}'.
+                        format(len(candidate_pairs[0]), similarity_graph.nnz, datetime.now() - start))
+            return similarity_graph
+        if threshold is not None or top_k is not None:
+            similarity_graph = MatrixCalculation.sparse_similarity_join(ohv_stacktrace, threshold, top_k)
+            logger.info('Calculating sparse similarity graph with {} similar pairs {}'.
+                        format(similarity_graph.nnz, datetime.now() - start))
+            return similarity_graph
         try:
-            numerator = np.dot(ohv_stacktrace, ohv_stacktrace.T)
+            if sparse.issparse(ohv_stacktrace):
+                numerator = (ohv_stacktrace @ ohv_stacktrace.T).toarray()
+                norm = np.sqrt(np.asarray(ohv_stacktrace.multiply(ohv_stacktrace).sum(axis=1)).ravel())
+            else:
+                numerator = np.dot(ohv_stacktrace, ohv_stacktrace.T)
+                norm = np.sqrt(np.sum(ohv_stacktrace ** 2, axis=1))
             assert numerator.shape == (ohv_stacktrace.shape[0], ohv_stacktrace.shape[0]), numerator.shape
-            denominator = np.sqrt(np.sum(ohv_stacktrace ** 2, axis=1))[:, np.newaxis] * np.sqrt(
-                np.sum(ohv_stacktrace ** 2, axis=1))[:, np.newaxis].T
+            denominator = norm[:, np.newaxis] * norm[:, np.newaxis].T
             assert (denominator > 0).all(), "Denominator is zero"
             similarity_matrix = np.multiply(numerator, 1 / denominator)
         except MemoryError:
@@ -159,35 +293,64 @@ class GraphManager:
 
     @staticmethod
     def get_top_k(array, k=3, reverse=False):
-        if reverse is False:
-            top_k_index = np.argsort(array)[-k:]
+        # Partial selection of the k candidates, only those are sorted (ascending like a full argsort)
+        array = np.asarray(array)
+        if k < len(array):
+            candidates = np.argpartition(array, -k)[-k:] if reverse is False else np.argpartition(array, k)[:k]
         else:
-            top_k_index = np.argsort(array)[:k]
-        return top_k_index
+            candidates = np.arange(len(array))
+        return candidates[np.argsort(array[candidates], kind='stable')]
 
     def get_top_k_nodes_in_pool(self, k=3, reverse=False):
-        nodes, weights = zip(*[(k, v.weight) for (k, v) in self.node_manager.pool.items()])
-        top_k_index = GraphManager.get_top_k(weights, k, reverse)
-        return np.array(nodes)[top_k_index][::-1], np.array(weights)[top_k_index][::-1]
+        if reverse is False and k <= self.node_manager.top_nodes.capacity:
+            top_k_index, weights = self.node_manager.top_nodes.top(k)
+        else:
+            weights = self.node_manager.weights.view()
+            top_k_index = GraphManager.get_top_k(weights, k, reverse)[::-1]
+            weights = weights[top_k_index]
+        names = self.node_manager.frame_dictionary.names
+        return np.array([names[frame_id] for frame_id in top_k_index.tolist()]), weights
+
+    def get_stacktrace(self, id_stacktrace):
+        names = self.node_manager.frame_dictionary.names
+        return [names[frame_id] for frame_id in self.stacktrace_manager.get_frames(id_stacktrace).tolist()]
 
     def get_top_k_stacktrace(self, k=3, reverse=False):
-        stacktraces, weights = zip(*self.stacktrace_manager.freq_stacktrace.items())
-        stacktraces = [self.stacktrace_manager.stacktrace[id_stacktrace] for id_stacktrace in stacktraces]
-        top_k_index = GraphManager.get_top_k(weights, k, reverse)
-        return np.array(stacktraces)[top_k_index][::-1], np.array(weights)[top_k_index][::-1]
+        if reverse is False and k <= self.stacktrace_manager.top_stacktraces.capacity:
+            top_k_index, weights = self.stacktrace_manager.top_stacktraces.top(k)
+        else:
+            weights = self.stacktrace_manager.freq_stacktrace.view()
+            top_k_index = GraphManager.get_top_k(weights, k, reverse)[::-1]
+            weights = weights[top_k_index]
+        stacktraces = [self.get_stacktrace(id_stacktrace) for id_stacktrace in top_k_index.tolist()]
+        return GraphUtil.to_object_array(stacktraces), weights
+
+    def query_similar_stacktraces(self, list_stacktrace):
+        """
+        Bucket new stacktraces against the LSH index of the stored stacktraces
+        :return: Candidate stacktrace IDs of every stacktrace, to be verified by exact similarity
+        """
+        self.stacktrace_manager.index_stacktraces()
+        frame_ids, lengths = self.node_manager.frame_dictionary.lookup_stacktraces(list_stacktrace)
+        # Frames unknown to the graph cannot collide with stored stacktraces and are left out of the sets
+        known = frame_ids >= 0
+        trace_index = np.repeat(np.arange(len(lengths)), lengths)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(trace_index[known], minlength=len(lengths)))))
+        lsh_index = self.stacktrace_manager.lsh_index
+        return lsh_index.query(lsh_index.signatures(frame_ids[known], offsets))
 
     def get_top_k_neighbor_nodes(self, node_name, k=1, reverse=False):
-        target_node = self.node_manager.get_node(node_name)
-        nodes, counts = zip(*target_node.out_edge.items())
+        frame_ids, counts = self.node_manager.out_edges.row(self.node_manager.frame_dictionary.index[node_name])
         top_k_index = GraphManager.get_top_k(counts, k, reverse)
-        return np.array(nodes)[top_k_index][::-1], np.array(counts)[top_k_index][::-1]
+        nodes = [self.node_manager.frame_dictionary.names[frame_id] for frame_id in frame_ids[top_k_index]]
+        return np.array(nodes)[::-1], counts[top_k_index][::-1]
 
     def get_top_k_stacktrace_along_node(self, node_name, k=1, reverse=False):
-        target_node = self.node_manager.get_node(node_name)
-        stacktraces, counts = zip(*target_node.fre_id_stacktrace.items())
-        stacktraces = [self.stacktrace_manager.stacktrace[id_stacktrace] for id_stacktrace in stacktraces]
+        id_stacktraces, counts = \
+            self.node_manager.stacktrace_freq.row(self.node_manager.frame_dictionary.index[node_name])
         top_k_index = GraphManager.get_top_k(counts, k, reverse)
-        return np.array(stacktraces)[top_k_index][::-1], np.array(counts)[top_k_index][::-1]
+        stacktraces = [self.get_stacktrace(id_stacktrace) for id_stacktrace in id_stacktraces[top_k_index]]
+        return GraphUtil.to_object_array(stacktraces)[::-1], counts[top_k_index][::-1]
 
     def __post_action__(self):
         g_dis.distribute(self)
@@ -198,87 +361,323 @@ class GraphManager:
 
 
 class Node:
+    __slots__ = ('name', 'weight', 'static_attribute')
+
     def __init__(self, name, default_weight=0, static_attribute=None):
         self.name = name
         self.weight = default_weight
-        self.out_edge = {}
-        self.in_edge = {}
-        self.fre_id_stacktrace = {}
         self.static_attribute = static_attribute
 
 
+class FrameDictionary:
+    """
+    Intern every frame name once into a dense integer ID
+    The MD5 form of a frame is only computed on demand at the persistence boundary
+    """
+    def __init__(self):
+        self.names = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def intern(self, name):
+        frame_id = self.index.get(name)
+        if frame_id is None:
+            frame_id = len(self.names)
+            self.index[name] = frame_id
+            self.names.append(name)
+        return frame_id
+
+    def intern_stacktrace(self, stacktrace):
+        return [self.intern(method) for method in stacktrace]
+
+    def lookup(self, name):
+        return self.index.get(name, -1)
+
+    def lookup_stacktrace(self, stacktrace):
+        return np.array([self.index.get(method, -1) for method in stacktrace], dtype=np.int32)
+
+    def lookup_stacktraces(self, list_stacktrace):
+        lengths = np.array([len(stacktrace) for stacktrace in list_stacktrace], dtype=np.int64)
+        frame_ids = np.fromiter((self.index.get(method, -1) for stacktrace in list_stacktrace for method in stacktrace),
+                                dtype=np.int64, count=int(lengths.sum()))
+        return frame_ids, lengths
+
+    def hash_id(self, frame_id):
+        return GraphUtil.__hash_md5__(self.names[frame_id])
+
+
 class NodeManager:
     def __init__(self):
         self.pool = {}
+        self.frame_dictionary = FrameDictionary()
+        self.out_edges = AdjacencyStore(g_conf.GraphEnvVar.EDGE_DELTA_SIZE)
+        self.stacktrace_freq = AdjacencyStore(g_conf.GraphEnvVar.EDGE_DELTA_SIZE)
+        self.weights = GrowableArray(np.int64)
+        self.top_nodes = TopKIndex(g_conf.GraphEnvVar.TOP_K_CAPACITY)
 
     def get_node(self, node_name):
-        return self.pool[GraphUtil.__hash_md5__(node_name)]
-
-    def init_nodes(self, stacktrace, static_attribute):
-        for method in stacktrace:
-            if method not in list(self.pool.keys()):
-                self.pool[GraphUtil.__hash_md5__(method)] = Node(method, static_attribute=static_attribute)
-            self.pool[GraphUtil.__hash_md5__(method)].weight += 1
-
-        for i in range(len(stacktrace) - 1):
-            node = self.pool[GraphUtil.__hash_md5__(stacktrace[i])]
-            next_node = self.pool[GraphUtil.__hash_md5__(stacktrace[i + 1])]
-            node.out_edge[GraphUtil.__hash_md5__(next_node.name)] = \
-                node.out_edge.get(GraphUtil.__hash_md5__(next_node.name), 0) + 1
-            next_node.in_edge[GraphUtil.__hash_md5__(node.name)] = \
-                next_node.in_edge.get(GraphUtil.__hash_md5__(node.name), 0) + 1
-
-        id_stacktrace = ' '.join(stacktrace)
-        hash_id_stacktrace = GraphUtil.__hash_md5__(id_stacktrace)
-        for method in stacktrace:
-            self.pool[GraphUtil.__hash_md5__(method)].fre_id_stacktrace[hash_id_stacktrace] = \
-                self.pool[GraphUtil.__hash_md5__(method)].fre_id_stacktrace.get(hash_id_stacktrace, 0) + 1
-
-    def init_pool(self, flatten_methods, flatten_static_attributes):
-        assert flatten_methods is not None, "Cannot initialize None node pools"
-        assert flatten_static_attributes is not None, "None attribute"
-        assert len(flatten_methods) == len(flatten_static_attributes), \
-            "Mismatched shape between {} and {}".format(len(flatten_methods), len(flatten_static_attributes))
-        nonexisted_nodes = {GraphUtil.__hash_md5__(method): Node(method, static_attribute=static_attribute)
-                            for method, static_attribute in zip(flatten_methods, flatten_static_attributes)
-                            if method not in list(self.pool.keys())}
-        self.pool.update(nonexisted_nodes)
-
-        for method in flatten_methods:
-            self.pool[GraphUtil.__hash_md5__(method)].weight += 1
-
-    def init_edges(self, list_stacktrace):
-        for stacktrace in list_stacktrace:
-            for i in range(len(stacktrace) - 1):
-                node = self.pool[GraphUtil.__hash_md5__(stacktrace[i])]
-                next_node = self.pool[GraphUtil.__hash_md5__(stacktrace[i + 1])]
-                node.out_edge[GraphUtil.__hash_md5__(next_node.name)] = \
-                    node.out_edge.get(GraphUtil.__hash_md5__(next_node.name), 0) + 1
-                next_node.in_edge[GraphUtil.__hash_md5__(node.name)] = \
-                    next_node.in_edge.get(GraphUtil.__hash_md5__(node.name), 0) + 1
-
-            hash_id_stacktrace = GraphUtil.__hash_md5__(' '.join(stacktrace))
-            for method in stacktrace:
-                self.pool[GraphUtil.__hash_md5__(method)].fre_id_stacktrace[hash_id_stacktrace] = \
-                    self.pool[GraphUtil.__hash_md5__(method)].fre_id_stacktrace.get(hash_id_stacktrace, 0) + 1
+        return self.pool[self.frame_dictionary.index[node_name]]
+
+    def add_weights(self, frame_ids, weights):
+        # Weight column indexed by frame ID, kept alongside the pool for vectorized top-k queries
+        frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        if len(self.weights) < len(self.frame_dictionary):
+            self.weights.extend(np.zeros(len(self.frame_dictionary) - len(self.weights)))
+        np.add.at(self.weights.view(), frame_ids, weights)
+        self.top_nodes.update(frame_ids, self.weights[frame_ids])
+
+    def init_nodes(self, frame_ids, id_stacktrace, static_attribute):
+        for frame_id in frame_ids:
+            if frame_id not in self.pool:
+                self.pool[frame_id] = Node(self.frame_dictionary.names[frame_id], static_attribute=static_attribute)
+            self.pool[frame_id].weight += 1
+        self.add_weights(frame_ids, 1)
+        self.__link__(frame_ids, id_stacktrace)
+
+    def init_pool(self, batch, static_attributes):
+        assert batch is not None, "Cannot initialize None node pools"
+        assert static_attributes is not None, "None attribute"
+        assert len(batch) == len(static_attributes), \
+            "Mismatched shape between {} and {}".format(len(batch), len(static_attributes))
+        if batch.frame_ids.size == 0:
+            return
+        frame_ids, first_index, inverse = np.unique(batch.frame_ids, return_index=True, return_inverse=True)
+        weights = np.bincount(inverse, weights=batch.counts[batch.trace_index]).astype(np.int64)
+        for frame_id, trace_index, weight in zip(frame_ids.tolist(), batch.trace_index[first_index].tolist(),
+                                                 weights.tolist()):
+            if frame_id not in self.pool:
+                self.pool[frame_id] = Node(self.frame_dictionary.names[frame_id],
+                                           static_attribute=static_attributes[trace_index])
+            self.pool[frame_id].weight += weight
+        self.add_weights(frame_ids, weights)
+
+    def init_edges(self, batch):
+        self.out_edges.add_batch(*AdjacencyStore.count_pairs(*batch.edge_pairs()))
+        self.stacktrace_freq.add_batch(*AdjacencyStore.count_pairs(batch.frame_ids,
+                                                                   batch.id_stacktrace[batch.trace_index],
+                                                                   batch.counts[batch.trace_index]))
+
+    def __link__(self, frame_ids, id_stacktrace):
+        for frame_id, next_frame_id in zip(frame_ids[:-1], frame_ids[1:]):
+            self.out_edges.add(frame_id, next_frame_id)
+        for frame_id in frame_ids:
+            self.stacktrace_freq.add(frame_id, id_stacktrace)
+
+    def merge_pool(self, other):
+        frame_remap = np.array([self.frame_dictionary.intern(name) for name in other.frame_dictionary.names],
+                               dtype=np.int64)
+        for frame_id, node in other.pool.items():
+            target_id = int(frame_remap[frame_id])
+            target_node = self.pool.get(target_id)
+            if target_node is None:
+                self.pool[target_id] = Node(node.name, node.weight, node.static_attribute)
+            else:
+                target_node.weight += node.weight
+        other_frame_ids = np.fromiter(other.pool.keys(), dtype=np.int64, count=len(other.pool))
+        self.add_weights(frame_remap[other_frame_ids], [other.pool[frame_id].weight for frame_id in
+                                                        other_frame_ids.tolist()])
+        return frame_remap
+
+    def merge_edges(self, other, frame_remap, stacktrace_remap):
+        src, dst, counts = other.out_edges.to_coo()
+        self.out_edges.add_batch(frame_remap[src], frame_remap[dst], counts)
+        src, dst, counts = other.stacktrace_freq.to_coo()
+        self.stacktrace_freq.add_batch(frame_remap[src], stacktrace_remap[dst], counts)
+
+    def in_edges(self):
+        return self.out_edges.transpose()
+
+    def compact(self):
+        self.out_edges.compact()
+        self.stacktrace_freq.compact()
+
+
+class StacktraceBatch:
+    """
+    Int-encoded chunk of stacktraces
+    All frame IDs are flattened into one array, `trace_index` tells which stacktrace each frame belongs to
+    and `counts` how many records share that stacktrace
+    """
+    def __init__(self, frame_dictionary, list_stacktrace, counts=None):
+        self.list_stacktrace = list_stacktrace
+        self.list_frame_ids = [frame_dictionary.intern_stacktrace(stacktrace) for stacktrace in list_stacktrace]
+        lengths = np.array([len(frame_ids) for frame_ids in self.list_frame_ids], dtype=np.int64)
+        self.frame_ids = np.fromiter((frame_id for frame_ids in self.list_frame_ids for frame_id in frame_ids),
+                                     dtype=np.int32, count=int(lengths.sum()))
+        self.trace_index = np.repeat(np.arange(len(lengths)), lengths)
+        self.counts = np.ones(len(lengths), dtype=np.int64) if counts is None else np.asarray(counts)
+        self.id_stacktrace = None
+
+    def __len__(self):
+        return len(self.list_frame_ids)
+
+    def edge_pairs(self):
+        same_stacktrace = self.trace_index[:-1] == self.trace_index[1:]
+        return self.frame_ids[:-1][same_stacktrace], self.frame_ids[1:][same_stacktrace], \
+            self.counts[self.trace_index[:-1][same_stacktrace]]
+
+
+class UUIDIndex:
+    """
+    Hash set of tracked UUIDs giving O(1) membership checks
+    A StacktraceManager rebuilds it from its uuids column on load, standalone it pickles as a sorted int64 array
+    """
+    def __init__(self, uuids=()):
+        self.members = set(uuids)
+
+    def __contains__(self, _id):
+        return _id in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def append(self, _id):
+        self.members.add(_id)
+
+    def extend(self, ids):
+        self.members.update(ids)
+
+    def to_array(self):
+        return np.sort(np.fromiter(self.members, dtype=np.int64, count=len(self.members)))
+
+    def __getstate__(self):
+        return {'members': self.to_array()}
+
+    def __setstate__(self, state):
+        self.members = set(state['members'].tolist())
 
 
 class StacktraceManager:
+    """
+    Columnar store of unique stacktraces
+    Each unique stacktrace is kept once as the int32 slice frames[offsets[i]:offsets[i + 1]] and UUIDs map to
+    stacktrace IDs through the parallel `uuids` / `uuid_stacktrace` columns
+    """
     def __init__(self):
-        self.uuid = []
-        self.stacktrace = {}
-        self.node_stacktrace = {}
-        self.freq_stacktrace = {}
-        self.uuid_nodes_map = {}
-
-    def track(self, node_pool, _id, stacktrace):
+        self.uuid = UUIDIndex()
+        self.stacktrace_index = {}
+        self.frames = GrowableArray(np.int32)
+        self.offsets = GrowableArray(np.int64)
+        self.offsets.append(0)
+        self.freq_stacktrace = GrowableArray(np.int64)
+        self.uuids = GrowableArray(np.int64)
+        self.uuid_stacktrace = GrowableArray(np.int32)
+        self.top_stacktraces = TopKIndex(g_conf.GraphEnvVar.TOP_K_CAPACITY)
+        # Built on the first similarity query, or before saving when GraphEnvVar.LSH_CANDIDATES is set
+        self.lsh_index = None
+
+    def __len__(self):
+        return len(self.freq_stacktrace)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The LSH index outweighs the frames column, it is persisted only when LSH candidates are enabled
+        if not g_conf.GraphEnvVar.LSH_CANDIDATES:
+            state['lsh_index'] = None
+        # Every unique stacktrace is persisted once, in the frames column, its lookup key is rebuilt on load
+        del state['stacktrace_index']
+        # Tracked UUIDs are persisted once, in the uuids column
+        del state['uuid']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'uuid' not in state:
+            self.uuid = UUIDIndex(self.uuids.view().tolist())
+        if 'stacktrace_index' not in state:
+            frames, offsets = self.frames.view(), self.offsets.view().tolist()
+            self.stacktrace_index = {frames[start:end].tobytes(): id_stacktrace for id_stacktrace, (start, end) in
+                                     enumerate(zip(offsets[:-1], offsets[1:]))}
+
+    def index_stacktraces(self):
+        if self.lsh_index is None:
+            self.lsh_index = MinHashLSH(g_conf.GraphEnvVar.LSH_NUM_PERM, g_conf.GraphEnvVar.LSH_NUM_BANDS,
+                                        max_bucket_size=g_conf.GraphEnvVar.LSH_MAX_BUCKET_SIZE)
+        # Stacktrace IDs are append-only, only the ones added since the last call are hashed into the LSH index
+        num_indexed = len(self.lsh_index)
+        if num_indexed < len(self):
+            offsets = self.offsets.view()[num_indexed:]
+            self.lsh_index.add(self.lsh_index.signatures(self.frames[offsets[0]:offsets[-1]], offsets - offsets[0]))
+
+    def get_id_stacktrace(self, frame_ids):
+        frame_ids = np.asarray(frame_ids, dtype=np.int32)
+        key = frame_ids.tobytes()
+        id_stacktrace = self.stacktrace_index.get(key)
+        if id_stacktrace is None:
+            id_stacktrace = len(self.stacktrace_index)
+            self.stacktrace_index[key] = id_stacktrace
+            self.frames.extend(frame_ids)
+            self.offsets.append(len(self.frames))
+            self.freq_stacktrace.append(0)
+        return id_stacktrace
+
+    def get_frames(self, id_stacktrace):
+        return self.frames[self.offsets[id_stacktrace]:self.offsets[id_stacktrace + 1]]
+
+    def hash_id(self, id_stacktrace, frame_dictionary):
+        return GraphUtil.__hash_md5__(' '.join(frame_dictionary.names[frame_id] for frame_id in
+                                               self.get_frames(id_stacktrace).tolist()))
+
+    def add_freqs(self, id_stacktraces, freqs):
+        id_stacktraces = np.asarray(id_stacktraces, dtype=np.int64)
+        np.add.at(self.freq_stacktrace.view(), id_stacktraces, freqs)
+        self.top_stacktraces.update(id_stacktraces, self.freq_stacktrace[id_stacktraces])
+
+    def uuid_items(self):
+        return zip(self.uuids.view().tolist(), self.uuid_stacktrace.view().tolist())
+
+    def merge(self, other, frame_remap):
+        stacktrace_remap = np.array([self.get_id_stacktrace(frame_remap[other.get_frames(id_stacktrace)])
+                                     for id_stacktrace in range(len(other))], dtype=np.int64)
+        self.add_freqs(stacktrace_remap, other.freq_stacktrace.view())
+        self.uuid.extend(other.uuid)
+        self.uuids.extend(other.uuids.view())
+        self.uuid_stacktrace.extend(stacktrace_remap[other.uuid_stacktrace.view()])
+        return stacktrace_remap
+
+    def track_batch(self, ids, batch, inverse):
+        # Stacktraces of a batch are unique, `inverse` maps every UUID to its stacktrace in the batch
+        self.uuid.extend(ids)
+        self.add_freqs(batch.id_stacktrace, batch.counts)
+        self.uuids.extend(ids)
+        self.uuid_stacktrace.extend(batch.id_stacktrace[inverse])
+
+    def track(self, _id, id_stacktrace):
         self.uuid.append(_id)
-        nodes_stacktrace = [node_pool[GraphUtil.__hash_md5__(st)] for st in stacktrace]
-        hash_id_stacktrace = GraphUtil.__hash_md5__(' '.join(stacktrace))
-        self.stacktrace[hash_id_stacktrace] = stacktrace
-        self.node_stacktrace[hash_id_stacktrace] = nodes_stacktrace
-        self.freq_stacktrace[hash_id_stacktrace] = self.freq_stacktrace.get(hash_id_stacktrace, 0) + 1
-        self.uuid_nodes_map[_id] = nodes_stacktrace
+        self.add_freqs([id_stacktrace], 1)
+        self.uuids.append(_id)
+        self.uuid_stacktrace.append(id_stacktrace)
+
+
+class IngestionProgress:
+    def __init__(self):
+        self.num_records = 0
+        self.num_skipped = 0
+        self.num_batches = 0
+        self.num_frames = 0
+        self.peak_buffered_bytes = 0
+        self.start = datetime.now()
+
+    def update(self, num_records, num_frames, buffered_bytes):
+        self.num_records += num_records
+        self.num_frames += num_frames
+        self.num_batches += 1
+        self.peak_buffered_bytes = max(self.peak_buffered_bytes, buffered_bytes)
+
+    def elapsed(self):
+        return datetime.now() - self.start
+
+    def throughput(self):
+        seconds = self.elapsed().total_seconds()
+        return self.num_records / seconds if seconds > 0 else 0.0
 
 
 class GraphUtil:
@@ -286,3 +685,16 @@ class GraphUtil:
     def __hash_md5__(string):
         hash_object = hashlib.md5(string.encode())
         return hash_object.hexdigest()
+
+    @staticmethod
+    def to_object_array(values):
+        # 1-D object array of lists, avoiding NumPy's attempt to build a ragged 2-D array
+        array = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            array[i] = value
+        return array
+
+    @staticmethod
+    def estimate_size(stacktrace):
+        # Approximate bytes of raw text held by a parsed stacktrace, one pointer per method included
+        return sum(len(method) for method in stacktrace) + 8 * len(stacktrace)
@@ -0,0 +1,138 @@
+import numpy as np
+from graph.core.columnar import GrowableArray
+
+
+class MinHashLSH:
+    """
+    MinHash signatures over frame-ID sets with a banded LSH index
+    Two sets collide in a band with probability J^rows_per_band for Jaccard similarity J, so more bands raise recall
+    and more rows per band raise precision; `threshold` estimates the similarity where both balance
+    Candidates are only a superset to verify, exact similarity still decides
+    Buckets larger than `max_bucket_size` (near-duplicate stacktraces) link every member to their first member only,
+    which leader verification needs, instead of materializing all their pairs
+    """
+    # Mersenne prime 2^31 - 1, products of 31-bit coefficients and 31-bit IDs stay within uint64
+    PRIME = (1 << 31) - 1
+    # Upper bound of frames hashed at once, each costs num_perm uint64 hashes
+    BLOCK_FRAMES = 1 << 16
+
+    def __init__(self, num_perm=128, num_bands=32, seed=1, max_bucket_size=64):
+        assert num_perm % num_bands == 0, "num_perm must be a multiple of num_bands"
+        assert max_bucket_size >= 2, "max_bucket_size must be at least 2"
+        self.num_perm = num_perm
+        self.num_bands = num_bands
+        self.max_bucket_size = max_bucket_size
+        self.rows_per_band = num_perm // num_bands
+        self.seed = seed
+        random_state = np.random.RandomState(seed)
+        self.a = random_state.randint(1, MinHashLSH.PRIME, size=num_perm).astype(np.uint64)
+        self.b = random_state.randint(0, MinHashLSH.PRIME, size=num_perm).astype(np.uint64)
+        self.signature_columns = GrowableArray(np.uint32, capacity=1024 * num_perm)
+        self.buckets = [{} for _ in range(num_bands)]
+
+    def __len__(self):
+        return len(self.signature_columns) // self.num_perm
+
+    @property
+    def threshold(self):
+        return (1 / self.num_bands) ** (1 / self.rows_per_band)
+
+    def signatures(self, frame_ids, offsets):
+        """
+        :param frame_ids: Flat frame IDs of every set, e.g. CSR `indices` or the stacktrace `frames` column
+        :param offsets: Set boundaries of length n + 1, e.g. CSR `indptr`
+        :return: uint32 signatures of shape [n, num_perm], empty sets get the all-PRIME signature
+        """
+        frame_ids = np.asarray(frame_ids, dtype=np.uint64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        num_sets = len(offsets) - 1
+        signatures = np.full((num_sets, self.num_perm), MinHashLSH.PRIME, dtype=np.uint32)
+        start = 0
+        while start < num_sets:
+            # Grow the block of sets until it holds BLOCK_FRAMES frames, at least one set per block
+            stop = max(start + 1, int(np.searchsorted(offsets, offsets[start] + MinHashLSH.BLOCK_FRAMES,
+                                                      side='right')) - 1)
+            stop = min(stop, num_sets)
+            lengths = np.diff(offsets[start:stop + 1])
+            non_empty = np.flatnonzero(lengths > 0)
+            if len(non_empty) > 0:
+                block = frame_ids[offsets[start]:offsets[stop]]
+                hashes = (block[:, None] * self.a + self.b) % MinHashLSH.PRIME
+                starts = (offsets[start:stop] - offsets[start])[non_empty]
+                signatures[start + non_empty] = np.minimum.reduceat(hashes, starts, axis=0)
+            start = stop
+        return signatures
+
+    def __band_keys__(self, signatures, band):
+        band_signatures = np.ascontiguousarray(signatures[:, band * self.rows_per_band:
+                                                             (band + 1) * self.rows_per_band])
+        return band_signatures.view(np.dtype((np.void, band_signatures.dtype.itemsize * self.rows_per_band))).ravel()
+
+    def candidate_pairs(self, signatures):
+        """
+        Pairs of rows of `signatures` sharing at least one band bucket, without touching the index
+        :return: Unique (row, col) arrays with row < col
+        """
+        num_sets = len(signatures)
+        keys = []
+        for band in range(self.num_bands):
+            _, buckets = np.unique(self.__band_keys__(signatures, band), return_inverse=True)
+            rows, cols = MinHashLSH.__bucket_pairs__(buckets.ravel(), self.max_bucket_size)
+            keys.append(rows.astype(np.int64) * num_sets + cols)
+        keys = np.unique(np.concatenate(keys)) if len(keys) > 0 else np.zeros(0, dtype=np.int64)
+        return keys // max(num_sets, 1), keys % max(num_sets, 1)
+
+    @staticmethod
+    def __bucket_pairs__(buckets, max_bucket_size):
+        # Members of a bucket are adjacent after a stable sort, so the first member is the lowest row of the bucket
+        order = np.argsort(buckets, kind='stable')
+        starts = np.flatnonzero(np.concatenate(([True], buckets[order][1:] != buckets[order][:-1])))
+        sizes = np.diff(np.append(starts, len(order)))
+        bucket_start = np.repeat(starts, sizes)
+        bucket_size = np.repeat(sizes, sizes)
+        rank = np.arange(len(order)) - bucket_start
+        # Large buckets: every member is linked to the first member
+        star = (bucket_size > max_bucket_size) & (rank > 0)
+        rows, cols = [order[bucket_start[star]]], [order[star]]
+        # Small buckets: every member is paired with the ones `step` places after, only members of buckets larger
+        # than `step` stay active, so the loop costs the number of pairs and never rescans the whole array
+        active = np.flatnonzero((bucket_size > 1) & (bucket_size <= max_bucket_size))
+        step = 1
+        while len(active) > 0:
+            active = active[rank[active] + step < bucket_size[active]]
+            rows.append(order[active])
+            cols.append(order[active + step])
+            step += 1
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        return np.minimum(rows, cols), np.maximum(rows, cols)
+
+    def add(self, signatures):
+        """
+        Index signatures under consecutive IDs following the ones already indexed
+        """
+        first_id = len(self)
+        self.signature_columns.extend(signatures.ravel())
+        for band in range(self.num_bands):
+            bucket = self.buckets[band]
+            for i, key in enumerate(self.__band_keys__(signatures, band).tolist()):
+                bucket.setdefault(key, []).append(first_id + i)
+
+    def query(self, signatures):
+        """
+        :return: Candidate indexed IDs of every signature as sorted int64 arrays
+        """
+        candidates = [[] for _ in range(len(signatures))]
+        for band in range(self.num_bands):
+            bucket = self.buckets[band]
+            for i, key in enumerate(self.__band_keys__(signatures, band).tolist()):
+                candidates[i].extend(bucket.get(key, ()))
+        return [np.unique(np.array(ids, dtype=np.int64)) for ids in candidates]
+
+    def __getstate__(self):
+        # Buckets are derived from the signatures, only the latter are persisted
+        return {'num_perm': self.num_perm, 'num_bands': self.num_bands, 'seed': self.seed,
+                'max_bucket_size': self.max_bucket_size, 'signature_columns': self.signature_columns}
+
+    def __setstate__(self, state):
+        self.__init__(state['num_perm'], state['num_bands'], state['seed'], state.get('max_bucket_size', 64))
+        self.add(state['signature_columns'].view().reshape(-1, self.num_perm))
@@ -1,26 +1,137 @@
 import numpy as np
+from scipy import sparse
 
 
 class MatrixCalculation:
+    # Upper bound of candidate entries materialized by one block product of the sparse similarity join
+    BLOCK_ENTRIES = 2 ** 24
+    # Slack of every threshold comparison: binary cosines land exactly on common thresholds (4/5, 8/10 for 0.8) and
+    # float32 and float64 round them to either side, so paths computing in different precisions would disagree
+    SCORE_TOLERANCE = 1e-6
 
     @staticmethod
-    def doc_doc_similarity(matrix_a, matrix_b):
+    def above_threshold(score, threshold):
+        return score >= threshold - MatrixCalculation.SCORE_TOLERANCE
+
+    @staticmethod
+    def group_labels(labels):
+        """
+        One stable sort groups the docids of every label in ascending order, so a leader pivot, the lowest doc of
+        its cluster, comes first
+        :return: Map from every label to its docids
+        """
+        labels = np.asarray(labels)
+        order = np.argsort(labels, kind='stable')
+        unique_labels, counts = np.unique(labels[order], return_counts=True)
+        return dict(zip(unique_labels.tolist(), [docids.tolist() for docids in
+                                                 np.split(order, np.cumsum(counts)[:-1])]))
+
+    @staticmethod
+    def column_table(node_ids, num_frames):
+        """
+        :return: Column of every frame ID below num_frames, -1 for frames outside the nodes, plus a trailing -1 that
+        catches unknown frames looked up as -1
+        """
+        frame_columns = np.full(num_frames + 1, -1, dtype=np.int64)
+        frame_columns[np.asarray(node_ids, dtype=np.int64)] = np.arange(len(node_ids))
+        return frame_columns
+
+    @staticmethod
+    def one_hot(frame_ids, lengths, frame_columns, num_columns, dtype=np.int32):
+        """
+        Binary doc-term matrix of stacktraces given as flat frame IDs, frames without a column are dropped
+        :param frame_columns: Table of `column_table`, frame IDs beyond it fall on its trailing -1
+        :return: Sparse CSR matrix of shape [len(lengths), num_columns]
+        """
+        frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        in_table = (frame_ids >= 0) & (frame_ids < len(frame_columns) - 1)
+        columns = frame_columns[np.where(in_table, frame_ids, -1)]
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        known = columns >= 0
+        matrix = sparse.csr_matrix((np.ones(np.count_nonzero(known), dtype=dtype), (rows[known], columns[known])),
+                                   shape=(len(lengths), num_columns))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix
+
+    @staticmethod
+    def doc_doc_similarity(matrix_a, matrix_b, norm_a=None, norm_b=None):
         """
         Shape of 2 matrices must be a[m,n] * b[n,m]
         Basic dot product, for other inner product consider to use broadcasting
         :param matrix_a: Vector a
         :param matrix_b: Vector b
+        :param norm_a: Cached row norms of matrix a, computed when not given
+        :param norm_b: Cached column norms of matrix b, computed when not given
         :return: Cosine simliarity
         """
         assert matrix_a.shape[1] == matrix_b.shape[0], "Mismatched shape between matrix A and matrix B"
-        numerator = np.dot(matrix_a, matrix_b)
+        norm_a = MatrixCalculation.row_norms(matrix_a) if norm_a is None else norm_a
+        norm_b = MatrixCalculation.row_norms(matrix_b.T) if norm_b is None else norm_b
+        if sparse.issparse(matrix_a) or sparse.issparse(matrix_b):
+            # Sparse product, only the [m, m] result is dense
+            numerator = (sparse.csr_matrix(matrix_a) @ sparse.csc_matrix(matrix_b)).toarray()
+        else:
+            numerator = np.dot(matrix_a, matrix_b)
         assert numerator.shape == (matrix_a.shape[0], matrix_b.shape[1]), numerator.shape
-        denominator = np.sqrt(np.sum(matrix_a ** 2, axis=1))[:, np.newaxis] * np.sqrt(
-            np.sum(matrix_b.T ** 2, axis=1))[:, np.newaxis].T
+        denominator = norm_a[:, np.newaxis] * norm_b[np.newaxis, :]
         assert (denominator > 0).all(), "Denominator is zero {}".format(denominator)
         similarity_matrix = np.multiply(numerator, 1 / denominator)
         return similarity_matrix
 
+    @staticmethod
+    def row_norms(matrix):
+        if sparse.issparse(matrix):
+            return np.sqrt(np.asarray(sparse.csr_matrix(matrix).multiply(matrix).sum(axis=1)).ravel())
+        return np.sqrt(np.sum(np.asarray(matrix) ** 2, axis=1))
+
+    @staticmethod
+    def pack_bits(matrix):
+        """
+        Bit-pack the rows of a binary matrix into uint64 words, column c is bit c % 64 of word c // 64
+        :return: uint64 matrix of shape [n, ceil(m / 64)]
+        """
+        num_rows, num_columns = matrix.shape
+        num_words = max(1, -(-num_columns // 64))
+        if sparse.issparse(matrix):
+            matrix = sparse.coo_matrix(matrix)
+            packed = np.zeros((num_rows, num_words), dtype=np.uint64)
+            columns = matrix.col.astype(np.uint64)
+            np.bitwise_or.at(packed, (matrix.row, (columns >> np.uint64(6)).astype(np.int64)),
+                             np.uint64(1) << (columns & np.uint64(63)))
+            return packed
+        packed = np.packbits(np.asarray(matrix) != 0, axis=1, bitorder='little')
+        packed = np.pad(packed, ((0, 0), (0, 8 * num_words - packed.shape[1])))
+        return np.ascontiguousarray(packed).view('<u8').astype(np.uint64)
+
+    @staticmethod
+    def __popcount__(words):
+        if hasattr(np, 'bitwise_count'):
+            return np.bitwise_count(words)
+        # Byte lookup table for NumPy versions without bitwise_count
+        table = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+        return table[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+    @staticmethod
+    def popcount_similarity(packed_a, packed_b):
+        """
+        Cosine similarity of bit-packed binary rows, |a & b| / sqrt(|a| |b|) with popcount over uint64 words
+        Rows of `packed_a` are processed in steps bounded by BLOCK_ENTRIES words of intermediate
+        :param packed_a: Packed rows of shape [m, w]
+        :param packed_b: Packed rows of shape [k, w]
+        :return: Dense similarity of shape [m, k], 0 against empty rows
+        """
+        assert packed_a.shape[1] == packed_b.shape[1], "Mismatched number of words"
+        sizes_a = MatrixCalculation.__popcount__(packed_a).sum(axis=1, dtype=np.int64)
+        sizes_b = MatrixCalculation.__popcount__(packed_b).sum(axis=1, dtype=np.int64)
+        intersection = np.empty((packed_a.shape[0], packed_b.shape[0]), dtype=np.int64)
+        step = max(1, MatrixCalculation.BLOCK_ENTRIES // max(packed_b.shape[0] * packed_b.shape[1], 1))
+        for start in range(0, packed_a.shape[0], step):
+            intersection[start:start + step] = MatrixCalculation.__popcount__(
+                packed_a[start:start + step, np.newaxis, :] & packed_b[np.newaxis, :, :]).sum(axis=-1, dtype=np.int64)
+        denominator = np.sqrt(sizes_a[:, np.newaxis] * sizes_b[np.newaxis, :])
+        return np.divide(intersection, denominator, out=np.zeros(intersection.shape), where=denominator > 0)
+
     @staticmethod
     def xnor_score(matrix_a, matrix_b, weights=1):
         """
@@ -33,3 +144,72 @@ class MatrixCalculation:
         assert matrix_a.shape[1] == matrix_b.shape[0], "Mismatched shape between matrix A and matrix B"
         weights = np.array([1] * matrix_a.shape[1]) if weights == 1 else weights
         return np.sum((matrix_a[..., np.newaxis] == matrix_b.T) * weights[..., np.newaxis], axis=1)/np.sum(weights)
+
+    @staticmethod
+    def sparse_similarity_join(matrix, threshold=None, top_k=None, block_size=None):
+        """
+        Cosine similarity between all rows of a matrix, computed block by block with sparse products
+        Only pairs scoring at least `threshold` and/or within the `top_k` most similar of their row are kept,
+        so memory scales with the number of similar pairs instead of N^2
+        :param matrix: Dense or sparse doc-term matrix of shape [n, m]
+        :param threshold: Minimum cosine similarity of a kept pair
+        :param top_k: Maximum number of kept pairs per row
+        :param block_size: Rows per block, by default bounded by BLOCK_ENTRIES candidate entries
+        :return: Sparse neighbor graph of shape [n, n] in CSR format, self-similarity included
+        """
+        assert threshold is not None or top_k is not None, "Either threshold or top_k must be defined"
+        matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+        num_docs = matrix.shape[0]
+        block_size = max(1, MatrixCalculation.BLOCK_ENTRIES // max(num_docs, 1)) if block_size is None \
+            else block_size
+        norm = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norm[norm == 0] = 1
+        normalized = sparse.csr_matrix(sparse.diags(1 / norm) @ matrix)
+        normalized_t = normalized.T.tocsc()
+        rows, cols, data = [], [], []
+        for start in range(0, num_docs, block_size):
+            block = (normalized[start:start + block_size] @ normalized_t).tocoo()
+            keep = MatrixCalculation.above_threshold(block.data, threshold) if threshold is not None \
+                else np.ones(block.nnz, dtype=bool)
+            row, col, score = block.row[keep], block.col[keep], block.data[keep]
+            if top_k is not None:
+                row, col, score = MatrixCalculation.__row_top_k__(row, col, score, top_k)
+            rows.append(row + start)
+            cols.append(col)
+            data.append(score)
+        if num_docs == 0:
+            return sparse.csr_matrix((0, 0))
+        return sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape=(num_docs, num_docs))
+
+    @staticmethod
+    def candidate_similarity(matrix, row, col, threshold):
+        """
+        Cosine similarity verified only on candidate pairs, e.g. produced by MinHashLSH
+        :param row: Candidate row indices
+        :param col: Candidate column indices
+        :return: Symmetric sparse neighbor graph of shape [n, n] in CSR format, self-similarity included
+        """
+        matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+        num_docs = matrix.shape[0]
+        norm = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norm[norm == 0] = 1
+        normalized = sparse.csr_matrix(sparse.diags(1 / norm) @ matrix)
+        score = np.asarray(normalized[row].multiply(normalized[col]).sum(axis=1)).ravel()
+        keep = MatrixCalculation.above_threshold(score, threshold)
+        row, col, score = row[keep], col[keep], score[keep]
+        self_score = np.asarray(normalized.multiply(normalized).sum(axis=1)).ravel()
+        diagonal = np.flatnonzero(MatrixCalculation.above_threshold(self_score, threshold))
+        self_score = self_score[diagonal]
+        return sparse.csr_matrix((np.concatenate((score, score, self_score)),
+                                  (np.concatenate((row, col, diagonal)), np.concatenate((col, row, diagonal)))),
+                                 shape=(num_docs, num_docs))
+
+    @staticmethod
+    def __row_top_k__(row, col, score, top_k):
+        # Rank entries within their row by descending score, keep ranks below top_k
+        order = np.lexsort((-score, row))
+        row, col, score = row[order], col[order], score[order]
+        row_start = np.searchsorted(row, row, side='left')
+        keep = np.arange(len(row)) - row_start < top_k
+        return row[keep], col[keep], score[keep]
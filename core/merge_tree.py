@@ -0,0 +1,51 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+from graph.core.matrix import MatrixCalculation
+
+
+class MergeTree:
+    """
+    Single-linkage merge tree over a sparse similarity graph
+    The tree is the maximum spanning forest of the graph, kept as its N - 1 (or fewer) edges sorted by descending
+    similarity. Single-linkage clusters at a threshold are the components of the edges scoring at or above it,
+    so any threshold down to `min_threshold` is cut in O(N) without touching the similarity graph again
+    """
+    def __init__(self, min_threshold=0.5):
+        self.min_threshold = min_threshold
+        self.num_docs = 0
+        self.left = np.zeros(0, dtype=np.int32)
+        self.right = np.zeros(0, dtype=np.int32)
+        self.similarity = np.zeros(0, dtype=np.float32)
+
+    def fit(self, similarity_graph):
+        """
+        :param similarity_graph: Sparse [n, n] similarity graph holding at least the pairs above min_threshold
+        """
+        graph = sparse.coo_matrix(similarity_graph)
+        keep = (graph.row != graph.col) & MatrixCalculation.above_threshold(graph.data, self.min_threshold)
+        self.num_docs = graph.shape[0]
+        # Minimum spanning forest on distances 2 - similarity, strictly positive so no edge is dropped as missing
+        distance = sparse.csr_matrix((2 - graph.data[keep], (graph.row[keep], graph.col[keep])), shape=graph.shape)
+        forest = csgraph.minimum_spanning_tree(distance).tocoo()
+        order = np.argsort(forest.data, kind='stable')
+        self.left = forest.row[order].astype(np.int32)
+        self.right = forest.col[order].astype(np.int32)
+        self.similarity = (2 - forest.data[order]).astype(np.float32)
+        return self
+
+    def cut(self, threshold):
+        """
+        :return: Labels of every doc, clusters numbered by their lowest doc
+        """
+        assert threshold >= self.min_threshold, "Tree was built down to {} only".format(self.min_threshold)
+        num_edges = np.searchsorted(-self.similarity,
+                                    -np.float32(threshold - MatrixCalculation.SCORE_TOLERANCE), side='right')
+        forest = sparse.csr_matrix((np.ones(num_edges, dtype=np.int8),
+                                    (self.left[:num_edges], self.right[:num_edges])),
+                                   shape=(self.num_docs, self.num_docs))
+        _, labels = csgraph.connected_components(forest, directed=False)
+        return labels
+
+    def cut_groups(self, threshold):
+        return MatrixCalculation.group_labels(self.cut(threshold))
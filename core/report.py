@@ -26,6 +26,7 @@ class ClusterReport:
                  labels=None,
                  clusterid_docids_mapping=None,
                  clusterid_errorlogids_map=None,
+                 clusterid_model_map=None,
                  score_matrix=None,
                  evaluation_report=None):
         self.cluster_algorithms = cluster_algorithms
@@ -33,6 +34,7 @@ class ClusterReport:
         self.score_matrix = score_matrix
         self.clusterid_docids_map = clusterid_docids_mapping
         self.clusterid_errorlogids_map = clusterid_errorlogids_map
+        self.clusterid_model_map = clusterid_model_map
         self.labels = labels
         self.evaluation_report = evaluation_report
 
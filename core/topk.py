@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class TopKIndex:
+    """
+    Incrementally maintained top-`capacity` set over monotonically increasing counters
+    Counters only grow during ingestion, so an ID outside the set can only enter when its new total beats the
+    smallest total inside, which keeps the set exact without ever rescanning the whole pool
+    """
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.int64)
+
+    def update(self, ids, values):
+        """
+        :param ids: Updated IDs, may contain duplicates
+        :param values: New totals of the updated IDs (not increments)
+        """
+        ids, values = np.asarray(ids, dtype=np.int64), np.asarray(values, dtype=np.int64)
+        if len(self.ids) >= self.capacity:
+            entering = values >= self.values.min()
+            ids, values = ids[entering], values[entering]
+        if len(ids) == 0:
+            return
+        ids = np.concatenate((self.ids, ids))
+        values = np.concatenate((self.values, values))
+        # Keep the latest (largest) total of every ID
+        order = np.lexsort((values, ids))
+        ids, values = ids[order], values[order]
+        last = np.concatenate((ids[1:] != ids[:-1], [True]))
+        ids, values = ids[last], values[last]
+        if len(ids) > self.capacity:
+            keep = np.argpartition(values, -self.capacity)[-self.capacity:]
+            ids, values = ids[keep], values[keep]
+        self.ids, self.values = ids, values
+
+    def top(self, k):
+        order = np.argsort(self.values, kind='stable')[::-1][:k]
+        return self.ids[order], self.values[order]